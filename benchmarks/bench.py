@@ -0,0 +1,485 @@
+"""
+Benchmarks for mining, chain generation and merkle trees.
+
+Every suite returns a list of result rows (dicts). The rows are written to a JSON file together
+with some information about the run, so results can be tracked between releases and a new
+mining/merkle engine can be compared against a stored baseline.
+
+Run: python benchmarks/bench.py [--suite pow] [--quick] [--output bench.json] [--compare baseline.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+sys.path.insert(1, SRC_DIR)
+
+import blockchain_structs as bs
+import blockstore
+import headerstore
+import miner
+import nipopow
+import proof_codec
+from merkle import MerkleTree
+
+# every block is a valid solution, used when only the work around the PoW is of interest
+EASY_DIFFICULTY = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF
+
+SUITES = {}
+
+def suite(name):
+    """ Registers a benchmark suite, the function gets the quick flag and returns a list of rows"""
+    def register(func):
+        SUITES[name] = func
+        return func
+    return register
+
+@contextlib.contextmanager
+def quiet():
+    # the structures print progress messages, keep them out of the timings output
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def make_txs(count):
+    return [miner.create_coinbase_tx(miner.MINER[1], 25) for _ in range(count)]
+
+def next_block(chain: bs.Blockchain, txs):
+    block = bs.Block(chain.head, txs, chain.height + 1)
+    block.interlink = nipopow.Interlink(chain.chain[0])
+    block.interlink.update_interlink(chain.head, chain.difficulty)
+    return block
+
+def build_chain(length, difficulty=0x3FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF):
+    """ Chain of blocks holding a single coinbase tx each, quick to make in large numbers"""
+    with quiet():
+        chain = miner.generate_blockchain(0, 25, difficulty)
+    return extend_chain(chain, length)
+
+def extend_chain(chain, length):
+    with quiet():
+        while len(chain.chain) < length:
+            chain.add_block(miner.find_pow(next_block(chain, make_txs(1)), chain.difficulty))
+    return chain
+
+@suite("pow")
+def bench_pow(quick):
+    """ find_pow hashes/sec against chain height and tx count"""
+    difficulty = 0x0000FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF # about 2^16 attempts per block
+    heights = [1, 10, 100] if quick else [1, 10, 100, 1000]
+    tx_counts = [0, 100] if quick else [0, 100, 1000]
+    rows = []
+    with quiet():
+        chain = miner.generate_blockchain(0, 25, EASY_DIFFICULTY)
+    for height in heights:
+        with quiet():
+            while chain.height < height:
+                chain.add_block(miner.find_pow(next_block(chain, make_txs(1)), EASY_DIFFICULTY))
+        for tx_count in tx_counts:
+            attempts, elapsed = 0, 0.0
+            for _ in range(1 if quick else 3):
+                with quiet():
+                    block = next_block(chain, make_txs(tx_count))
+                start = time.perf_counter()
+                miner.find_pow(block, difficulty)
+                elapsed += time.perf_counter() - start
+                attempts += block.nonce + 1
+            rows.append({"height": height, "txs": tx_count, "attempts": attempts,
+                "seconds": elapsed, "hashes_per_sec": attempts / elapsed})
+    return rows
+
+@suite("chain")
+def bench_chain(quick):
+    """ generate_blockchain blocks/sec at several difficulties"""
+    difficulties = [EASY_DIFFICULTY, 0x0FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF, 0x00FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF]
+    if not quick:
+        difficulties.append(0x000FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF)
+    block_num = 10 if quick else 50
+    rows = []
+    for difficulty in difficulties:
+        start = time.perf_counter()
+        with quiet():
+            chain = miner.generate_blockchain(block_num, 25, difficulty)
+        elapsed = time.perf_counter() - start
+        rows.append({"difficulty": hex(difficulty), "blocks": len(chain.chain), "seconds": elapsed,
+            "blocks_per_sec": len(chain.chain) / elapsed})
+    return rows
+
+@suite("merkle_build")
+def bench_merkle_build(quick):
+    """ Block.get_merkle time per block size"""
+    sizes = [10, 100, 1000] if quick else [10, 100, 1000, 10000, 100000]
+    rows = []
+    for size in sizes:
+        txs = make_txs(size)
+        with quiet():
+            block = bs.Block(None, txs, 0)
+            repeat = max(1, 1000 // size)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                block.get_merkle()
+            elapsed = (time.perf_counter() - start) / repeat
+        rows.append({"txs": size, "seconds_per_block": elapsed, "txs_per_sec": size / elapsed})
+    return rows
+
+@suite("merkle_path")
+def bench_merkle_path(quick):
+    """ MerkleTree.get_path latency"""
+    sizes = [10, 100, 1000] if quick else [10, 100, 1000, 10000, 100000]
+    rows = []
+    for size in sizes:
+        tree = MerkleTree()
+        values = [f"tx{i}" for i in range(size)]
+        for value in values:
+            tree.addNode(value)
+        with quiet():
+            tree.initialize()
+        queries = random.Random(size).choices(values, k=100)
+        start = time.perf_counter()
+        for value in queries:
+            tree.get_path(value)
+        elapsed = (time.perf_counter() - start) / len(queries)
+        rows.append({"leaves": size, "seconds_per_path": elapsed})
+    return rows
+
+@suite("proof_size")
+def bench_proof_size(quick):
+    """ Encoded NiPoPoW proof size against chain length, it should grow logarithmically"""
+    lengths = [100, 1000] if quick else [100, 1000, 10000, 50000]
+    k, m = 6, 3
+    rows = []
+    chain = None
+    for length in lengths:
+        chain = build_chain(length) if chain is None else extend_chain(chain, length)
+        txn = chain.chain[length // 2].txs[0].tx_id
+        with quiet():
+            suffix = nipopow.suffix_proof(chain, k, m, chain.difficulty)
+            infix = nipopow.infix_proof(chain, k, m, chain.difficulty, txn)
+        rows.append({"blocks": length, "suffix_bytes": proof_codec.proof_size(suffix),
+            "infix_bytes": proof_codec.proof_size(infix),
+            "infix_full_interlink_bytes": proof_codec.proof_size(infix, proof_codec.FULL),
+            "infix_headers": len(set(block.block_hash for block in nipopow.chain_from_proof(infix[0] + [infix[1], infix[2]])))})
+    return rows
+
+@suite("verify")
+def bench_verify(quick):
+    """ Light client verify_infix time against chain length, on decoded proofs as the client receives them"""
+    lengths = [1000, 10000] if quick else [1000, 10000, 100000, 1000000]
+    k, m = 6, 3
+    rows = []
+    chain = None
+    for length in lengths:
+        chain = build_chain(length) if chain is None else extend_chain(chain, length)
+        txn = chain.chain[length // 2].txs[0].tx_id
+        with quiet():
+            stored = nipopow.get_superchain(chain, nipopow.find_top_chain(chain, m, chain.difficulty, k), chain.difficulty, k)
+            data = proof_codec.encode_proof(nipopow.infix_proof(chain, k, m, chain.difficulty, txn))
+            # decoded apart, the interlink multi-proofs are checked once per decoded proof
+            proofs = [proof_codec.decode_proof(data) for _ in range(20)]
+            start = time.perf_counter()
+            for proof in proofs:
+                valid = nipopow.verify_infix(proof, stored, k, chain.chain[0], txn)
+            elapsed = (time.perf_counter() - start) / len(proofs)
+        rows.append({"blocks": length, "valid": valid, "proof_headers": len(nipopow.chain_from_proof(proof[0] + [proof[1], proof[2]])),
+            "seconds_per_verify": elapsed})
+    return rows
+
+@suite("store")
+def bench_store(quick):
+    """ Block store write rate and the time to reopen it and reload the chain, against chain length"""
+    lengths = [1000, 10000] if quick else [1000, 10000, 100000]
+    rows = []
+    chain = None
+    directory = tempfile.mkdtemp()
+    try:
+        for length in lengths:
+            chain = build_chain(length) if chain is None else extend_chain(chain, length)
+            path = os.path.join(directory, f"chain{length}.dat")
+            start = time.perf_counter()
+            with blockstore.BlockStore(path, chain.coinbase, chain.difficulty) as store:
+                for block in chain.chain:
+                    store.append(block)
+            written = time.perf_counter() - start
+            start = time.perf_counter()
+            with blockstore.BlockStore(path) as store:
+                opened = time.perf_counter() - start
+                reloaded = bs.Blockchain.from_store(store)
+                loaded = time.perf_counter() - start
+            rows.append({"blocks": len(reloaded.chain), "bytes": os.path.getsize(path),
+                "blocks_written_per_sec": length / written, "open_seconds": opened, "reload_seconds": loaded})
+    finally:
+        shutil.rmtree(directory)
+    return rows
+
+@suite("headers")
+def bench_headers(quick):
+    """ SPV header file: open time, lookups/sec and memory against the number of headers, next to a list of header dicts"""
+    sizes = [10000, 100000] if quick else [10000, 100000, 1000000]
+    rows = []
+    directory = tempfile.mkdtemp()
+    try:
+        for size in sizes:
+            path = os.path.join(directory, f"headers{size}")
+            with headerstore.HeaderStore(path) as headers:
+                for height in range(size):
+                    headers.append_header(random.getrandbits(160).to_bytes(20, "big").hex(), height, height,
+                        random.getrandbits(160).to_bytes(20, "big").hex())
+            heights = [random.randrange(size) for _ in range(10000)]
+            start = time.perf_counter()
+            with headerstore.HeaderStore(path) as headers:
+                headers[size - 1]
+                opened = time.perf_counter() - start
+                start = time.perf_counter()
+                for height in heights:
+                    headers[height]["merkle"]
+                lookups = len(heights) / (time.perf_counter() - start)
+            # memory is traced in a second pass, tracing slows the lookups down
+            tracemalloc.start()
+            with headerstore.HeaderStore(path) as headers:
+                for height in heights:
+                    headers[height]["merkle"]
+                store_peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.reset_peak()
+                as_dicts = list(headers)
+                dicts_peak = tracemalloc.get_traced_memory()[1]
+            del as_dicts
+            tracemalloc.stop()
+            rows.append({"headers": size, "open_seconds": opened, "lookups_per_sec": lookups,
+                "store_peak_bytes": store_peak, "dict_list_peak_bytes": dicts_peak})
+    finally:
+        shutil.rmtree(directory)
+    return rows
+
+def make_spending_txs(count):
+    """ Txs spending one signed UTXO to two outputs, like the ones create_txs makes"""
+    utxo = bs.UTXO(25, miner.MINER[1], miner.get_tx_hash(make_txs(1)[0]), 0)
+    utxo.sign_utxo(miner.MINER[0])
+    txs = []
+    for i in range(count):
+        spent = bs.UTXO(25, miner.MINER[1], utxo.id[0], i)
+        spent.sig = utxo.sig # signing every tx would dominate the setup, the signature isn't checked here
+        txs.append(bs.Transaction([spent], [bs.UTXO(10, miner.ADDRESSES[0][1]), bs.UTXO(15, miner.MINER[1])]))
+    return txs
+
+def rate(func, items):
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    return len(items) / (time.perf_counter() - start)
+
+@suite("serialize")
+def bench_serialize(quick):
+    """ Tx ids/sec and signing messages/sec with the binary encoding, against the indented json dump it replaced"""
+    txs = make_spending_txs(10000 if quick else 100000)
+    utxos = [tx.vin[0] for tx in txs]
+    json_dump = lambda o: json.dumps(o, indent = 4, default=bs.json_default).encode()
+    return [
+        {"item": "tx_id", "per_sec": rate(bs.Transaction.get_hash, txs),
+            "json_per_sec": rate(lambda tx: bs.sha1(json_dump(tx)).hexdigest(), txs)},
+        {"item": "signing_message", "per_sec": rate(bs.UTXO.signing_message, utxos),
+            "json_per_sec": rate(lambda utxo: json_dump(utxo.get_message()), utxos)},
+    ]
+
+# object_memory numbers of the tree before UTXO, Transaction and Block got __slots__ and the merkle trees kept
+# raw digests (tx count -> bytes per tx, per block, per merkle node). They can't be measured from this tree, so
+# they were taken once from a worktree of the "[user-020]" commit (the parent of the "[user-021]" one), running
+# the loop of bench_object_memory below minus the UTXOSet step (that tree had no UTXO set); a rerun there gives
+# the same numbers to within a few bytes. Measure again and update them if the steps below change.
+PRE_SLOTS_BYTES = {10000: (593, 14743, 130), 100000: (589, 16840, 139), 1000000: (589, 16097, 139)}
+
+@suite("object_memory")
+def bench_object_memory(quick):
+    """
+    Traced memory per tx, per block (without its txs) and per merkle tree node, for chains of up to 10^6 txs,
+    next to the numbers from before __slots__ (PRE_SLOTS_BYTES)
+    """
+    tx_counts = [10000, 100000] if quick else [10000, 100000, 1000000]
+    txs_per_block = 100
+    rows = []
+    for count in tx_counts:
+        tracemalloc.start()
+        with quiet():
+            txs = make_txs(count)
+            tx_bytes = tracemalloc.get_traced_memory()[0]
+            chain = miner.generate_blockchain(0, 25, EASY_DIFFICULTY)
+            before = tracemalloc.get_traced_memory()[0]
+            for start in range(0, count, txs_per_block):
+                chain.add_block(miner.find_pow(next_block(chain, txs[start:start + txs_per_block]), EASY_DIFFICULTY))
+            block_bytes = tracemalloc.get_traced_memory()[0] - before
+            before = tracemalloc.get_traced_memory()[0]
+            tree = MerkleTree()
+            for tx in txs[:min(count, 100000)]:
+                tree.addNode(tx.tx_id)
+            tree.initialize()
+            tree_bytes = tracemalloc.get_traced_memory()[0] - before
+            # the share of the chain's UTXO set in bytes_per_block, which the pre-slots numbers don't have
+            before = tracemalloc.get_traced_memory()[0]
+            utxos = bs.UTXOSet()
+            for block in chain.chain[2:]:
+                utxos.apply_block(block)
+            utxo_bytes = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        blocks = len(chain.chain) - 2
+        nodes = sum(len(level) for level in tree.levels)
+        pre_slots = PRE_SLOTS_BYTES.get(count, (None, None, None))
+        rows.append({"txs": count, "bytes_per_tx": tx_bytes / count,
+            # includes the chain's indexes (tx index, block index, UTXO set) for the block
+            "bytes_per_block": block_bytes / blocks, "utxo_set_bytes_per_block": utxo_bytes / blocks,
+            "bytes_per_merkle_node": tree_bytes / nodes, "pre_slots_bytes_per_tx": pre_slots[0],
+            "pre_slots_bytes_per_block": pre_slots[1], "pre_slots_bytes_per_merkle_node": pre_slots[2]})
+        del txs, chain, tree, utxos
+    return rows
+
+def make_signed_inputs(count):
+    """ Signed UTXOs spending outputs of the address book, with a UTXOSet holding those outputs"""
+    utxos = bs.UTXOSet()
+    inputs = []
+    for index in range(count):
+        priv_key, pub_key = miner.ADDRESSES[index % len(miner.ADDRESSES)]
+        output = bs.UTXO(25, pub_key, f"{index:040x}", 0)
+        utxos.add(output)
+        utxo = bs.UTXO(25, pub_key, *output.id)
+        utxo.sign_utxo(priv_key)
+        inputs.append(utxo)
+    return inputs, utxos
+
+@suite("sig_verify")
+def bench_sig_verify(quick):
+    """ Input signatures verified/sec by verify_block, in this process (workers 0) and with VerifierPools"""
+    inputs, utxos = make_signed_inputs(300 if quick else 2000)
+    with quiet():
+        block = bs.Block(None, [bs.Transaction([utxo], [bs.UTXO(25, miner.MINER[1])]).set_tx_id() for utxo in inputs], 1)
+    worker_counts = sorted({1, 2, 4, os.cpu_count() or 1}) if not quick else [1, 2]
+    rows = []
+    for workers in [0] + worker_counts:
+        # every run verifies the signatures itself, forked workers would inherit a filled cache
+        miner.verified_signatures.clear()
+        with contextlib.ExitStack() as stack:
+            pool = stack.enter_context(miner.VerifierPool(workers)) if workers else None
+            if pool is not None:
+                pool.verify(miner.input_signatures(block, utxos)[:workers]) # starts the worker processes
+            start = time.perf_counter()
+            valid = miner.verify_block(block, utxos, pool)
+            elapsed = time.perf_counter() - start
+        rows.append({"workers": workers, "signatures": len(inputs), "valid": valid,
+            "signatures_per_sec": len(inputs) / elapsed})
+    return rows
+
+@suite("key_cache")
+def bench_key_cache(quick):
+    """ Signatures made and verified per second parsing the hex keys every time, with the key caches and with the verified signature cache"""
+    from ecdsa import SigningKey, VerifyingKey, NIST192p
+    inputs, _ = make_signed_inputs(100 if quick else 500)
+    priv_keys = dict((pub_key, priv_key) for priv_key, pub_key in miner.ADDRESSES)
+    signatures = [(utxo.pub_key, utxo.signing_message(), bytes.fromhex(utxo.sig)) for utxo in inputs]
+    parse_sign = lambda utxo: SigningKey.from_string(bytes.fromhex(priv_keys[utxo.pub_key])).sign(utxo.signing_message())
+    parse_verify = lambda signature: VerifyingKey.from_string(bytes.fromhex(signature[0]), curve=NIST192p).verify(signature[2], signature[1])
+    bs.signing_keys.clear()
+    bs.verifying_keys.clear()
+    sign = {"op": "sign", "parsed_per_sec": rate(parse_sign, inputs),
+        "cached_keys_per_sec": rate(lambda utxo: utxo.sign_utxo(priv_keys[utxo.pub_key]), inputs)}
+    verify = {"op": "verify", "parsed_per_sec": rate(parse_verify, signatures),
+        "cached_keys_per_sec": rate(lambda signature: bs.verifying_key(signature[0]).verify(signature[2], signature[1]), signatures)}
+    miner.verified_signatures.clear()
+    for signature in signatures:
+        miner.verify_signature(*signature)
+    verify["verified_cache_per_sec"] = rate(lambda signature: miner.verify_signature(*signature), signatures)
+    return [sign, verify]
+
+@suite("utxo_set")
+def bench_utxo_set(quick):
+    """ UTXOSet memory per output (the UTXO objects belong to the blocks) and lookups/sec as the set grows"""
+    sizes = [10000, 100000] if quick else [10000, 100000, 1000000]
+    owners = [address[1] for address in miner.ADDRESSES] + [miner.MINER[1]]
+    rows = []
+    for size in sizes:
+        outputs = []
+        for index in range(size):
+            utxo = bs.UTXO(25, owners[index % len(owners)])
+            utxo.set_tx_id(f"{index:040x}", index)
+            outputs.append(utxo)
+        tracemalloc.start()
+        utxos = bs.UTXOSet()
+        for utxo in outputs:
+            utxos.add(utxo)
+        set_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        queries = [utxo.id for utxo in random.Random(size).choices(outputs, k=10000)]
+        rows.append({"outputs": size, "bytes_per_output": set_bytes / size,
+            "lookups_per_sec": rate(utxos.get, queries),
+            "balances_per_sec": rate(utxos.balance, [owners[i % len(owners)] for i in range(10000)]),
+            "spends_per_sec": rate(utxos.spend, list(dict.fromkeys(queries)))})
+        del outputs, utxos
+    return rows
+
+def interlink_bytes(interlinks):
+    """ Memory held by the interlinks, counting each shared run once (the hash strings belong to the blocks)"""
+    seen = set()
+    total = 0
+    for interlink in interlinks:
+        total += sys.getsizeof(interlink)
+        run = interlink.runs
+        while run is not None and id(run) not in seen:
+            seen.add(id(run))
+            total += sys.getsizeof(run)
+            run = run.above
+    return total
+
+@suite("interlink_memory")
+def bench_interlink_memory(quick):
+    """ Interlink memory per block against chain length, compared with a list copied for every block"""
+    lengths = [1000, 10000] if quick else [1000, 10000, 50000]
+    rows = []
+    chain = None
+    for length in lengths:
+        chain = build_chain(length) if chain is None else extend_chain(chain, length)
+        interlinks = [block.interlink for block in chain.chain if block.interlink is not None]
+        shared = interlink_bytes(interlinks)
+        copied = sum(sys.getsizeof(interlink.interlink) for interlink in interlinks)
+        rows.append({"blocks": length, "levels": len(chain.head.interlink),
+            "bytes_per_block": shared / len(interlinks), "list_bytes_per_block": copied / len(interlinks)})
+    return rows
+
+def run_info():
+    return {"python": platform.python_version(), "platform": platform.platform(),
+        "cpus": os.cpu_count(), "time": int(time.time())}
+
+def compare(results, baseline):
+    """ Prints the ratio of every numeric result against the matching row of a baseline run"""
+    for name, rows in results.items():
+        for row, base in zip(rows, baseline.get("results", {}).get(name, [])):
+            ratios = {key: value / base[key] for key, value in row.items()
+                if isinstance(value, float) and base.get(key)}
+            print(f"{name} {row}: " + ", ".join(f"{key} x{ratio:.2f}" for key, ratio in ratios.items()))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suite", action="append", choices=sorted(SUITES), help="suite to run (default: all)")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes, for a fast sanity run")
+    parser.add_argument("--output", default="bench.json", help="where to write the JSON results")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name in args.suite or sorted(SUITES):
+        print(f"Running {name}...")
+        results[name] = SUITES[name](args.quick)
+        for row in results[name]:
+            print("\t", row)
+    with open(args.output, "w") as fp:
+        json.dump({"info": run_info(), "quick": args.quick, "results": results}, fp, indent=4)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(results, json.load(fp))
+
+if __name__ == "__main__":
+    main()
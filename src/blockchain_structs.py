@@ -1,23 +1,126 @@
 from typing import *
 from hashlib import sha1
 from ecdsa import SigningKey, VerifyingKey, NIST192p
+from ecdsa.ellipticcurve import PointJacobi
+from bisect import bisect_left
+from heapq import merge
+import struct
 import time
 import json
 import merkle
+from cache import LRUCache
 
+# Fixed-size binary block header used as the proof of work preimage:
+# prev block hash | merkle root | interlink commitment | timestamp, followed by the nonce.
+# Everything but the nonce is constant while mining, so it is hashed once and reused.
+HEADER_PREFIX = struct.Struct(">20s32s20sQ")
+HEADER_NONCE = struct.Struct(">Q")
+HEADER_SIZE = HEADER_PREFIX.size + HEADER_NONCE.size
 
+# Canonical binary encoding of UTXOs and transactions, hashed for tx ids and UTXO hashes and signed by
+# sign_utxo. Unlike a json dump it doesn't depend on attribute order or formatting.
+#   utxo: value u64 | pub key length u8 | pub key | has id u8 | id tx hash 20 | id index u32 | sig length u8 | sig
+#   tx:   timestamp u64 | vin count u16 | vin utxos | vout count u16 | vout outputs
+#   output: value u64 | pub key length u8 | pub key
+# The signing message of a UTXO is its encoding with an empty signature. The outputs of a tx leave out the
+# id and signature, which are only set after the tx id is computed (and again when the output is spent).
+UTXO_VALUE = struct.Struct(">QB")
+UTXO_ID = struct.Struct(">B20sI")
+TX_TIMESTAMP = struct.Struct(">Q")
+TX_COUNT = struct.Struct(">H")
+_NO_ID = UTXO_ID.pack(0, bytes(20), 0)
 
-# UTXO set will be a hash map for quick retreival. (tx_id, UTXO)
+def digest_to_bytes(hex_digest, size: int = 20) -> bytes:
+    """ Converts a hex digest to raw bytes, using zero bytes for a missing digest (ie. genesis prev hash)"""
+    if not isinstance(hex_digest, str):
+        return bytes(size)
+    return bytes.fromhex(hex_digest)
+
+
+def difficulty_bits(difficulty: int) -> int:
+    """ Number of significant bits of a difficulty (at most the 160 bits of a sha1 digest)"""
+    return min(difficulty.bit_length(), 160)
+
+def superblock_level(block_hash: str, diff_bits: int) -> int:
+    """
+    Number of leading zeros the block hash has beyond the ones required by the difficulty, ie. the
+    block's superblock level. diff_bits comes from difficulty_bits(difficulty).
+    """
+    return diff_bits - int(block_hash, 16).bit_length()
+
+def json_default(o):
+    """ json.dumps default for the chain structures, gives the fields of a slotted object as they were in its __dict__"""
+    return o.json_fields() if hasattr(o, "json_fields") else o.__dict__
+
+def _hex(digest):
+    return digest.hex() if digest is not None else None
+
+def _from_hex(hex_digest):
+    return bytes.fromhex(hex_digest) if hex_digest is not None else None
+
+# Parsed keys by their hex string. The simulation signs and verifies with the same few addresses
+# over and over, so keys are parsed once instead of for every signature.
+KEY_CACHE_SIZE = 256
+signing_keys = LRUCache(KEY_CACHE_SIZE) # hex private key -> SigningKey
+verifying_keys = LRUCache(KEY_CACHE_SIZE) # hex public key -> VerifyingKey with precomputed tables
+
+def signing_key(priv_key: str) -> SigningKey:
+    """ SigningKey of a hex private key, parsing it (which derives its public key) only on a cache miss"""
+    key = signing_keys.get(priv_key)
+    if key is None:
+        key = SigningKey.from_string(bytes.fromhex(priv_key), curve=NIST192p)
+        signing_keys.put(priv_key, key)
+    return key
+
+def verifying_key(pub_key: str) -> VerifyingKey:
+    """
+    VerifyingKey of a hex public key, with the multiples of its point precomputed. That takes a few
+    ms once and then halves the time of every verify with the key, so the key is kept in a cache.
+    """
+    key = verifying_keys.get(pub_key)
+    if key is None:
+        point = VerifyingKey.from_string(bytes.fromhex(pub_key), curve=NIST192p).pubkey.point
+        # a parsed point doesn't know the curve order, which the precomputation needs
+        point = PointJacobi(NIST192p.curve, point.x(), point.y(), 1, NIST192p.order, generator=True)
+        key = VerifyingKey.from_public_point(point, curve=NIST192p)
+        key.precompute()
+        verifying_keys.put(pub_key, key)
+    return key
+
+# The UTXO set is a hash map (tx_id, index) -> UTXO for quick retreival, see UTXOSet.
 class UTXO:
     # This is what will be used as the message for ECDSA signature (where self.sig == "").
-    def __init__(self, value, pubkey) -> None:
+    # The signature is kept as raw bytes and id as its two parts, the properties give the old values.
+    # pub_key and the tx hash are left as strings, they are shared with the address book and the tx.
+    __slots__ = ("val", "pub_key", "_tx_hash", "_index", "_sig")
+
+    def __init__(self, value, pubkey, tx_hash = None, index = None) -> None:
         self.val = value
         self.pub_key = pubkey
-        self.id = None # set after the initial hash of tx
+        self.id = (tx_hash, index) if tx_hash is not None else None # set after the initial hash of tx
         self.sig = ""
 
+    @property
+    def id(self):
+        return (self._tx_hash, self._index) if self._tx_hash is not None else None
+
+    @id.setter
+    def id(self, outpoint):
+        self._tx_hash, self._index = outpoint if outpoint is not None else (None, None)
+
+    @property
+    def sig(self):
+        return self._sig.hex()
+
+    @sig.setter
+    def sig(self, sig):
+        self._sig = bytes.fromhex(sig)
+
+    def json_fields(self):
+        return {"val": self.val, "pub_key": self.pub_key, "id": self.id, "sig": self.sig}
+
     def to_json(self):
-        return json.dumps(self, indent = 4, default=lambda o: o.__dict__)
+        return json.dumps(self, indent = 4, default=json_default)
 
     def set_sig(self, sig):
         self.sig = sig
@@ -25,38 +128,72 @@ class UTXO:
     def set_tx_id(self, tx_hash, index):
         self.id = (tx_hash, index)
 
+    def serialize(self, signed = True) -> bytes:
+        """ Canonical binary encoding of the UTXO, without the signature if signed is False"""
+        pub_key = bytes.fromhex(self.pub_key)
+        sig = self._sig if signed else b""
+        outpoint = _NO_ID if self._tx_hash is None else UTXO_ID.pack(1, bytes.fromhex(self._tx_hash), self._index)
+        return b"".join([UTXO_VALUE.pack(self.val, len(pub_key)), pub_key, outpoint, bytes([len(sig)]), sig])
+
+    def serialize_output(self) -> bytes:
+        """ Encoding of the UTXO as an output of its transaction, value and pub key only"""
+        pub_key = bytes.fromhex(self.pub_key)
+        return UTXO_VALUE.pack(self.val, len(pub_key)) + pub_key
+
+    def signing_message(self) -> bytes:
+        """ The message signed by sign_utxo, the UTXO's encoding without its signature"""
+        return self.serialize(signed=False)
+
     def get_hash(self):
-        return sha1(json.dumps(self, indent = 4, default=lambda o: o.__dict__)).hexdigest()
+        return sha1(self.serialize()).hexdigest()
 
     def sign_utxo(self, priv_key):
-        """ priv_key must be a SigningKey object"""
+        """ priv_key must be a SigningKey object or a hex private key"""
         if type(priv_key) == str:
-            priv_key = SigningKey.from_string(bytearray.fromhex(priv_key))
-        message = self.to_json().encode()
-        sig = priv_key.sign(message)
+            priv_key = signing_key(priv_key)
+        sig = priv_key.sign(self.signing_message())
         self.sig = sig.hex()
 
     def get_message(self):
         """ Returns the same UTXO where self.sig is "" in order to get the message data. The message 
         is what is used to generate the signature in which a user is trying to verify."""
-        return UTXO(self.val, self.pub_key, self.id)
+        return UTXO(self.val, self.pub_key, self._tx_hash, self._index)
         
 
 class Transaction:
     # No tx fees
+    __slots__ = ("tx_id", "vin", "vout", "timestamp")
+
     def __init__(self, vin: List[UTXO], vout: List[UTXO]) -> None:
         self.tx_id = None
         self.vin = vin
         self.vout = vout
         self.timestamp = int(time.time_ns())
+
+    def json_fields(self):
+        return {"tx_id": self.tx_id, "vin": self.vin, "vout": self.vout, "timestamp": self.timestamp}
     
+    def serialize(self) -> bytes:
+        """ Canonical binary encoding of the transaction (without tx_id, which is its hash)"""
+        return b"".join([TX_TIMESTAMP.pack(self.timestamp), TX_COUNT.pack(len(self.vin))]
+            + [utxo.serialize() for utxo in self.vin]
+            + [TX_COUNT.pack(len(self.vout))]
+            + [utxo.serialize_output() for utxo in self.vout])
+
+    def get_hash(self):
+        return sha1(self.serialize()).hexdigest()
+
     def set_tx_id(self):
-        self.tx_id = sha1(json.dumps(self, indent = 4, default=lambda o: o.__dict__).encode()).hexdigest()
+        self.tx_id = self.get_hash()
         return self
 
 
 class Block:
     # Creates a new block that is ready for the mining process.
+    # The merkle root is kept as raw bytes for the binary header, the property gives the hex string.
+    __slots__ = ("block_hash", "_merkle_root", "prev_block", "txs", "height", "nonce", "level", "merkle_tree",
+        "interlink", "timestamp")
+
     def __init__(self, prev_block, txs: List[Transaction], height) -> None:
         self.block_hash = None
         self.merkle_root = None
@@ -64,20 +201,39 @@ class Block:
         self.txs = txs
         self.height = height
         self.nonce = 0
+        self.level = None # superblock level, set once the block is mined
+        self.merkle_tree = None # only used by add_tx
         self.get_merkle() # init merkle tree with block txns
         self.interlink = None
-        self.header = {
-            "merkle": self.merkle_root,
-            "nonce": self.nonce,
-            "timestamp": int(time.time())
-        }
+        self.timestamp = int(time.time())
     
     def __repr__(self) -> str:
         return self.block_hash
 
+    @property
+    def merkle_root(self):
+        return _hex(self._merkle_root)
+
+    @merkle_root.setter
+    def merkle_root(self, merkle_root):
+        self._merkle_root = _from_hex(merkle_root)
+
+    @property
+    def header(self):
+        """ The header fields as a dictionary, made on access from the block's own fields"""
+        return {"merkle": self.merkle_root, "nonce": self.nonce, "timestamp": self.timestamp}
+
+    def json_fields(self):
+        return {"block_hash": self.block_hash, "merkle_root": self.merkle_root, "prev_block": self.prev_block,
+            "txs": self.txs, "height": self.height, "nonce": self.nonce, "level": self.level,
+            "merkle_tree": self.merkle_tree, "interlink": self.interlink, "header": self.header}
+
     def set_block_hash(self, prev_hash):
         self.block_hash = prev_hash
 
+    def set_level(self, difficulty: int):
+        self.level = superblock_level(self.block_hash, difficulty_bits(difficulty))
+
     def init_interlink(self, genesis):
         self.interlink = nipopow.Interlink(genesis)
 
@@ -85,7 +241,29 @@ class Block:
         self.nonce = nonce
 
     def to_json(self):
-        return json.dumps(self, indent = 4, default=lambda o: o.__dict__)
+        return json.dumps(self, indent = 4, default=json_default)
+
+    def get_header_prefix(self) -> bytes:
+        """ Returns the binary header without the nonce. Its size does not depend on the chain height or tx count."""
+        prev_hash = self.prev_block.block_hash if self.prev_block is not None else None
+        commitment = self.interlink.get_commitment() if self.interlink is not None else bytes(20)
+        return HEADER_PREFIX.pack(digest_to_bytes(prev_hash), self._merkle_root or bytes(32), commitment, self.timestamp)
+
+    def get_header_bytes(self) -> bytes:
+        return self.get_header_prefix() + HEADER_NONCE.pack(self.nonce)
+
+    def compute_hash(self) -> str:
+        """ Hash of the binary header, this is what find_pow checks against the difficulty"""
+        return sha1(self.get_header_bytes()).hexdigest()
+
+    def add_tx(self, tx: Transaction):
+        """ Adds a tx to a block template, only the merkle nodes affected by the new leaf are hashed"""
+        if self.merkle_tree is None:
+            self.merkle_tree = merkle.IncrementalMerkleTree()
+            for block_tx in self.txs:
+                self.merkle_tree.append(block_tx.tx_id)
+        self.txs.append(tx)
+        self.merkle_root = self.merkle_tree.append(tx.tx_id)
 
     def get_merkle(self):
         mTree = merkle.MerkleTree()
@@ -96,17 +274,148 @@ class Block:
         if (mTree.root == None):
             self.merkle_root = "4a5e1e4baab89f3a32518a88c31bc87f618f76673e2cc77ab2127b7afdeda33b" #copying the merkle root of the bitcoin genesis
         else:
-            self.merkle_root = mTree.root.get_value()
+            self.merkle_root = mTree.root
+
+
+class BlockHeader:
+    """
+    Header of a block without its txs or link to the previous block, this is what a light client
+    gets from a proof (see proof_codec). Compares equal to the Block (or header) with the same hash.
+    """
+    __slots__ = ("block_hash", "height", "prev_hash", "merkle_root", "timestamp", "nonce", "interlink")
+
+    def __init__(self, block_hash, height, prev_hash, merkle_root, timestamp, nonce, interlink) -> None:
+        self.block_hash = block_hash
+        self.height = height
+        self.prev_hash = prev_hash
+        self.merkle_root = merkle_root
+        self.timestamp = timestamp
+        self.nonce = nonce
+        self.interlink = interlink
+
+    def __repr__(self) -> str:
+        return self.block_hash
+
+    def __eq__(self, other) -> bool:
+        if not hasattr(other, "block_hash"):
+            return NotImplemented
+        return self.block_hash == other.block_hash
+
+    def __hash__(self) -> int:
+        return hash(self.block_hash)
+
+    def get_header_bytes(self) -> bytes:
+        commitment = self.interlink.get_commitment() if self.interlink is not None else bytes(20)
+        return HEADER_PREFIX.pack(digest_to_bytes(self.prev_hash), bytes.fromhex(self.merkle_root),
+            commitment, self.timestamp) + HEADER_NONCE.pack(self.nonce)
+
+    def compute_hash(self) -> str:
+        return sha1(self.get_header_bytes()).hexdigest()
+
+
+class UTXOSet:
+    """
+    Unspent outputs of a chain keyed by their id (tx_id, index), with a pub key -> outputs index next
+    to it, so finding an output to spend, the outputs of an address and its balance are all O(1).
+    The UTXO objects are the vouts of the chain's blocks, not copies.
+    """
+    __slots__ = ("outputs", "owners", "balances")
+
+    def __init__(self) -> None:
+        self.outputs = {} # (tx_id, index) -> UTXO
+        self.owners = {} # pub key -> {(tx_id, index): UTXO} of the unspent outputs it owns
+        self.balances = {} # pub key -> total value of those outputs
+
+    def __len__(self):
+        return len(self.outputs)
+
+    def __contains__(self, outpoint):
+        return outpoint in self.outputs
+
+    def get(self, outpoint) -> Optional[UTXO]:
+        """ Returns the unspent output with id outpoint, or None if there is none"""
+        return self.outputs.get(outpoint)
+
+    def add(self, utxo: UTXO):
+        outpoint = utxo.id
+        self.outputs[outpoint] = utxo
+        self.owners.setdefault(utxo.pub_key, {})[outpoint] = utxo
+        self.balances[utxo.pub_key] = self.balances.get(utxo.pub_key, 0) + utxo.val
+
+    def spend(self, outpoint) -> Optional[UTXO]:
+        """ Removes the output with id outpoint and returns it, or None if it isn't unspent"""
+        utxo = self.outputs.pop(outpoint, None)
+        if utxo is None:
+            return None
+        owned = self.owners[utxo.pub_key]
+        del owned[outpoint]
+        if owned:
+            self.balances[utxo.pub_key] -= utxo.val
+        else:
+            del self.owners[utxo.pub_key]
+            del self.balances[utxo.pub_key]
+        return utxo
+
+    def unspent(self, pub_key: str) -> List[UTXO]:
+        """ The unspent outputs owned by pub_key, in the order they were added"""
+        return list(self.owners.get(pub_key, {}).values())
+
+    def balance(self, pub_key: str) -> int:
+        return self.balances.get(pub_key, 0)
+
+    def apply_block(self, block: Block):
+        """ Spends the outputs the block's txs take as input and adds their outputs, in tx order"""
+        for tx in block.txs:
+            for utxo in tx.vin:
+                if utxo.id is not None:
+                    self.spend(utxo.id)
+            for utxo in tx.vout:
+                self.add(utxo)
+
+
+class HeaderView:
+    """ Read-only list of the header dicts of a list of blocks, each made when it is looked up instead of stored"""
+    __slots__ = ("blocks",)
+
+    def __init__(self, blocks: List[Block]):
+        self.blocks = blocks
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [block.header for block in self.blocks[index]]
+        return self.blocks[index].header
+
+    def __iter__(self):
+        return (block.header for block in self.blocks)
 
 
 class Blockchain:
-    def __init__(self, coinbase: int, difficulty: int) -> None:
+    def __init__(self, coinbase: int, difficulty: int, store = None) -> None:
         self.coinbase = coinbase # reward transaction to miner
         self.difficulty = difficulty
+        self.difficulty_bits = difficulty_bits(difficulty)
         self.chain = [] # a list of Block objects
-        self.headers = []
+        self.headers = HeaderView(self.chain) # header dicts of the blocks, made on access
         self.height = 0 #height discounts the genesis block
         self.head = None
+        self.tx_index = {} # tx_id -> (block height, position of the tx in the block/merkle leaf index)
+        self.block_index = {} # block hash -> block, chain[height] is the block at that height
+        self.superchains = {} # superblock level -> heights of the blocks of exactly that level, ascending
+        self.level_counts = {} # superblock level -> number of blocks of that level
+        self.utxos = UTXOSet() # unspent outputs of the chain
+        self.store = store # blockstore.BlockStore every added block is written to, if any
+
+    @classmethod
+    def from_store(cls, store) -> "Blockchain":
+        """ Reloads the chain kept in a blockstore.BlockStore, blocks added later are appended to the store"""
+        blockchain = cls(store.coinbase, store.difficulty)
+        for block in store.read_chain():
+            blockchain.add_block(block)
+        blockchain.store = store
+        return blockchain
 
     def add_block(self, block: Block):
         """
@@ -114,11 +423,68 @@ class Blockchain:
         previous hash (at this point the block has been validated).
         """
         set_utxo_txid(block.txs)
+        if block.level is None:
+            block.level = superblock_level(block.block_hash, self.difficulty_bits)
         self.chain.append(block)
-        self.headers.append(block.header)
         if block.prev_block is not None:
             self.height += 1
         self.head = block
+        self.block_index[block.block_hash] = block
+        self.superchains.setdefault(block.level, []).append(block.height)
+        self.level_counts[block.level] = self.level_counts.get(block.level, 0) + 1
+        for position, tx in enumerate(block.txs):
+            self.tx_index[tx.tx_id] = (block.height, position)
+        self.utxos.apply_block(block)
+        if self.store is not None:
+            self.store.append(block)
+
+    def get_block(self, block_hash: str):
+        """ Returns the block with block_hash, or None if it is not in the chain"""
+        return self.block_index.get(block_hash)
+
+    def get_block_at(self, height: int):
+        """ Returns the block at height (the genesis is height 0)"""
+        return self.chain[height]
+
+    def _settled_height(self, k: int) -> int:
+        # blocks below this height are outside the last k (unsettled) blocks, like chain[:-k]
+        if k <= 0:
+            return 0
+        return max(len(self.chain) - k, 0)
+
+    def get_superchain(self, level: int, k: int, last: int = None) -> List["Block"]:
+        """
+        Returns the blocks of the given superblock level or higher, excluding the last k blocks of the chain.
+        With last, only the last that many of them are returned. Every block of the superchain points to the
+        one before it in its interlink at the given level, which is what lets a proof be checked link by link.
+        """
+        settled = self._settled_height(k)
+        runs = []
+        for block_level, heights in self.superchains.items():
+            if block_level >= level:
+                end = bisect_left(heights, settled)
+                runs.append(heights[max(end - last, 0) if last else 0:end])
+        heights = list(merge(*runs))
+        if last:
+            heights = heights[-last:]
+        return [self.chain[height] for height in heights]
+
+    def get_level_counts(self, k: int):
+        """ Returns {superblock level: number of blocks} excluding the last k blocks of the chain"""
+        counts = self.level_counts.copy()
+        for block in self.chain[self._settled_height(k):]:
+            counts[block.level] -= 1
+            if counts[block.level] == 0:
+                del counts[block.level]
+        return counts
+
+    def find_tx(self, tx_id: str):
+        """ Returns (block, position of the tx in the block) for tx_id, or None if it is not in the chain"""
+        location = self.tx_index.get(tx_id)
+        if location is None:
+            return None
+        height, position = location
+        return self.chain[height], position
 
 def set_utxo_txid(tx_list: List[Transaction]):
     # updates each utxo with the tx_id and index
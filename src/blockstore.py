@@ -0,0 +1,257 @@
+"""
+Append-only on-disk block store, so a node can restart from disk instead of mining its chain again.
+
+Blocks are appended to a data file, and an index file next to it (path + ".idx") holds one fixed-size
+record per block with the offset, length and hash of its data record. The record of height i is at
+i * INDEX_RECORD.size in the index, so reads by height are direct, and reads by hash go through a
+hash -> height dict built from the index when the store is opened. Both files are read through mmap.
+
+    data file:  magic "NPBS" | version u8 | difficulty 20 | coinbase u64 | block records
+    block:      height u32 | block hash 20 | prev hash 20 | merkle root length u8 | merkle root
+                | timestamp u64 | nonce u64 | level u8 | interlink | txs length u32 | txs (json)
+    interlink:  run count u8 (255 for no interlink) | runs (block hash 20 | top level u8) | genesis hash 20
+    index:      offset u64 | length u32 | block hash 20
+
+The interlink runs are stored in full so any block can be read on its own. When the chain is read in
+order, an interlink made by update_interlink from the previous block is rebuilt that way, so its
+levels are shared with the previous block's interlink again.
+
+A block is written to the data file before its index record, so after a crash the index only
+refers to complete blocks, and data past the last indexed block is cut off on the next open.
+"""
+import json
+import mmap
+import os
+import struct
+from typing import *
+import blockchain_structs as bs
+import nipopow
+
+MAGIC = b"NPBS"
+VERSION = 2
+_PREAMBLE = struct.Struct(">4sB20sQ")
+_BLOCK_START = struct.Struct(">I20s20sB")
+_BLOCK_END = struct.Struct(">QQB")
+_RUN = struct.Struct(">20sB")
+_TXS_LENGTH = struct.Struct(">I")
+INDEX_RECORD = struct.Struct(">QI20s")
+NO_INTERLINK = 255
+
+class BlockStore:
+    """
+    Block store at path. A new store needs the coinbase and difficulty of its chain, an existing one
+    reads them from the file. append() writes a block, read_block(height) and get(block_hash) read one back.
+    """
+    def __init__(self, path: str, coinbase: int = None, difficulty: int = None):
+        self.path = path
+        self.index_path = path + ".idx"
+        if not os.path.exists(path):
+            if difficulty is None or coinbase is None:
+                raise ValueError(f"No block store at {path}, a new one needs a coinbase and difficulty")
+            with open(path, "wb") as fp:
+                fp.write(_PREAMBLE.pack(MAGIC, VERSION, difficulty.to_bytes(20, "big"), coinbase))
+            open(self.index_path, "wb").close()
+        with open(path, "rb") as fp:
+            magic, version, difficulty_bytes, self.coinbase = _PREAMBLE.unpack(fp.read(_PREAMBLE.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a block store")
+        self.difficulty = int.from_bytes(difficulty_bytes, "big")
+        self._recover()
+        self.data_file = open(path, "ab")
+        self.index_file = open(self.index_path, "ab")
+        # mmap needs a readable file, the appending handles above are write only
+        self.data_reader = open(path, "rb")
+        self.index_reader = open(self.index_path, "rb")
+        self.data_map = None
+        self.index_map = None
+        self.heights = {} # block hash -> height
+        for height in range(len(self)):
+            self.heights[self._index_record(height)[2].hex()] = height
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for mapped in (self.data_map, self.index_map):
+            if mapped is not None:
+                mapped.close()
+        self.data_map = self.index_map = None
+        for fp in (self.data_file, self.index_file, self.data_reader, self.index_reader):
+            fp.close()
+
+    def _recover(self):
+        # drops a partly written index record or block left by a crash
+        index_size = os.path.getsize(self.index_path)
+        self.count = index_size // INDEX_RECORD.size
+        end = _PREAMBLE.size
+        if self.count:
+            with open(self.index_path, "rb") as fp:
+                fp.seek((self.count - 1) * INDEX_RECORD.size)
+                offset, length, _ = INDEX_RECORD.unpack(fp.read(INDEX_RECORD.size))
+            end = offset + length
+        if index_size != self.count * INDEX_RECORD.size:
+            os.truncate(self.index_path, self.count * INDEX_RECORD.size)
+        if os.path.getsize(self.path) > end:
+            os.truncate(self.path, end)
+        self.end = end
+
+    def _map(self, mapped, fp, size: int):
+        # (re)maps a file once reads go past the part mapped so far
+        if mapped is None or len(mapped) < size:
+            if mapped is not None:
+                mapped.close()
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return mapped
+
+    def _index_record(self, height: int):
+        if not 0 <= height < self.count:
+            raise IndexError(f"No block at height {height} in the store")
+        self.index_map = self._map(self.index_map, self.index_reader, self.count * INDEX_RECORD.size)
+        return INDEX_RECORD.unpack_from(self.index_map, height * INDEX_RECORD.size)
+
+    def append(self, block: bs.Block):
+        """ Writes block at the end of the store, blocks must be appended in height order"""
+        if block.height != self.count:
+            raise ValueError(f"Block at height {block.height} appended to a store of {self.count} blocks")
+        data = encode_block(block)
+        self.data_file.write(data)
+        self.data_file.flush()
+        self.index_file.write(INDEX_RECORD.pack(self.end, len(data), bs.digest_to_bytes(block.block_hash)))
+        self.index_file.flush()
+        self.heights[block.block_hash] = self.count
+        self.end += len(data)
+        self.count += 1
+
+    def read_record(self, height: int) -> bytes:
+        """ The encoded block at height, copied out of the mapped data file so it outlives the store"""
+        offset, length, _ = self._index_record(height)
+        self.data_map = self._map(self.data_map, self.data_reader, offset + length)
+        return self.data_map[offset:offset + length]
+
+    def read_block(self, height: int, prev_block: bs.Block = None) -> bs.Block:
+        """ Decodes the block at height. prev_block (the block below it) is linked and used to rebuild a derived interlink"""
+        return decode_block(self.read_record(height), prev_block)
+
+    def get(self, block_hash: str, prev_block: bs.Block = None):
+        """ Decodes the block with block_hash, or returns None if it is not in the store"""
+        height = self.heights.get(block_hash)
+        return None if height is None else self.read_block(height, prev_block)
+
+    def read_chain(self) -> Iterator[bs.Block]:
+        """ Decodes every block in height order, each linked to the one before it"""
+        prev_block = None
+        for height in range(self.count):
+            prev_block = self.read_block(height, prev_block)
+            yield prev_block
+
+def _encode_interlink(block: bs.Block) -> bytes:
+    if block.interlink is None:
+        return bytes([NO_INTERLINK])
+    runs = []
+    run = block.interlink.runs
+    while run is not None:
+        runs.append(_RUN.pack(bs.digest_to_bytes(run.block_hash), run.top))
+        run = run.above
+    return bytes([len(runs)]) + b"".join(runs) + bs.digest_to_bytes(block.interlink.genesis_hash)
+
+def encode_block(block: bs.Block) -> bytes:
+    prev_hash = block.prev_block.block_hash if block.prev_block is not None else None
+    merkle_root = bytes.fromhex(block.merkle_root)
+    txs = json.dumps(block.txs, separators=(",", ":"), default=bs.json_default).encode()
+    return b"".join([
+        _BLOCK_START.pack(block.height, bs.digest_to_bytes(block.block_hash), bs.digest_to_bytes(prev_hash), len(merkle_root)),
+        merkle_root,
+        _BLOCK_END.pack(block.timestamp, block.nonce, block.level),
+        _encode_interlink(block),
+        _TXS_LENGTH.pack(len(txs)),
+        txs
+    ])
+
+def _decode_utxo(fields) -> bs.UTXO:
+    utxo = bs.UTXO(fields["val"], fields["pub_key"])
+    utxo.id = tuple(fields["id"]) if fields["id"] is not None else None
+    utxo.sig = fields["sig"]
+    return utxo
+
+def _decode_tx(fields) -> bs.Transaction:
+    tx = bs.Transaction([_decode_utxo(utxo) for utxo in fields["vin"]], [_decode_utxo(utxo) for utxo in fields["vout"]])
+    tx.tx_id = fields["tx_id"]
+    tx.timestamp = fields["timestamp"]
+    return tx
+
+def _is_derived(runs, genesis_hash: str, prev_block: bs.Block) -> bool:
+    # whether runs are what update_interlink makes from prev_block
+    if prev_block is None or prev_block.interlink is None or prev_block.interlink.genesis_hash != genesis_hash:
+        return False
+    if runs[0] != (prev_block.block_hash, prev_block.level):
+        return False
+    above = prev_block.interlink.runs
+    while above is not None and above.top <= prev_block.level:
+        above = above.above
+    for block_hash, top in runs[1:]:
+        if above is None or (above.block_hash, above.top) != (block_hash, top):
+            return False
+        above = above.above
+    return above is None
+
+def _decode_interlink(record, offset: int, prev_block: bs.Block):
+    count = record[offset]
+    offset += 1
+    if count == NO_INTERLINK:
+        return None, offset
+    runs = []
+    for _ in range(count):
+        block_hash, top = _RUN.unpack_from(record, offset)
+        runs.append((block_hash.hex(), top))
+        offset += _RUN.size
+    genesis_hash = record[offset:offset + 20].hex()
+    interlink = nipopow.Interlink.__new__(nipopow.Interlink)
+    interlink._commitment = None
+    if runs and _is_derived(runs, genesis_hash, prev_block):
+        # the previous block's level is stored, so no difficulty is needed to rebuild it
+        interlink.update_interlink(prev_block, None)
+    else:
+        interlink.genesis_hash = genesis_hash
+        interlink.runs = None
+        for block_hash, top in reversed(runs):
+            interlink.runs = nipopow._Run(block_hash, top, interlink.runs)
+    return interlink, offset + 20
+
+def decode_block(record, prev_block: bs.Block = None) -> bs.Block:
+    """ Builds the Block encoded in record, linked to prev_block"""
+    height, block_hash, prev_hash, merkle_length = _BLOCK_START.unpack_from(record, 0)
+    offset = _BLOCK_START.size
+    merkle_root = record[offset:offset + merkle_length].hex()
+    timestamp, nonce, level = _BLOCK_END.unpack_from(record, offset + merkle_length)
+    offset += merkle_length + _BLOCK_END.size
+    if prev_block is not None and prev_block.block_hash != prev_hash.hex():
+        raise ValueError(f"Stored block {height} does not follow block {prev_block.block_hash}")
+    # the block is rebuilt field by field, Block() would recompute its merkle tree
+    block = bs.Block.__new__(bs.Block)
+    block.block_hash = block_hash.hex()
+    block.merkle_root = merkle_root
+    block.prev_block = prev_block
+    block.height = height
+    block.nonce = nonce
+    block.level = level
+    block.merkle_tree = None
+    block.timestamp = timestamp
+    block.interlink, offset = _decode_interlink(record, offset, prev_block)
+    (txs_length,) = _TXS_LENGTH.unpack_from(record, offset)
+    offset += _TXS_LENGTH.size
+    block.txs = [_decode_tx(fields) for fields in json.loads(record[offset:offset + txs_length])]
+    return block
+
+def load_blockchain(path: str):
+    """ Reopens the block store at path and reloads its chain, returns None if there is no store there yet"""
+    if not os.path.exists(path):
+        return None
+    chain = bs.Blockchain.from_store(BlockStore(path))
+    print(f"Loaded {len(chain.chain)} blocks from {path}")
+    return chain
@@ -0,0 +1,46 @@
+"""
+Bounded least recently used cache, used by the full node to keep built merkle trees around.
+"""
+from collections import OrderedDict
+
+class LRUCache:
+    """
+    Dictionary-like cache holding at most maxsize entries. Looking up or adding an entry makes it the most
+    recently used one, when the cache is full the least recently used entry is evicted.
+    hits, misses and evictions count what happened so the size can be tuned for a query mix.
+    """
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        self.entries[key] = value
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {"size": len(self.entries), "maxsize": self.maxsize, "hits": self.hits,
+            "misses": self.misses, "evictions": self.evictions}
@@ -10,49 +10,138 @@ Holds the current blockchain as well as a method to verify transactions
 """
 import blockchain_structs as bs
 from merkle import MerkleTree
+from cache import LRUCache
 import nipopow
+import proof_codec
+import miner
 from typing import *
 
 
 class FullNode:
-    def __init__(self, blockchain: bs.Blockchain) -> None:
+    def __init__(self, blockchain: bs.Blockchain, tree_cache_size: int = 128, verifier = None) -> None:
         self.blockchain = blockchain
+        self.verifier = verifier # miner.VerifierPool checking the signatures of added blocks, if any
         self.difficulty = None
+        self.tree_cache = LRUCache(tree_cache_size) # block hash -> initialized MerkleTree of its txs
+        self.suffix_cache = {} # (tip hash, k, m) -> suffix proof of the chain ending at that tip
 
     def set_difficulty(self, difficulty: int):
         self.difficulty = difficulty
+
+    def get_difficulty(self):
+        return self.difficulty if self.difficulty is not None else self.blockchain.difficulty
+
+    def add_block(self, block: bs.Block):
+        # Adds a block to the blockchain and shifts the cached suffix proofs onto the new tip
+        if not miner.verify_block(block, self.blockchain.utxos, self.verifier):
+            raise ValueError(f"Block {block.block_hash} has invalid inputs or signatures")
+        old_tip = self.blockchain.head.block_hash if self.blockchain.head else None
+        self.blockchain.add_block(block)
+        cached = self.suffix_cache
+        self.suffix_cache = {}
+        for (tip, k, m), proof in cached.items():
+            if tip != old_tip:
+                continue
+            proof = nipopow.update_suffix_proof(self.blockchain, proof, k, m, self.get_difficulty())
+            if proof is not None:
+                self.suffix_cache[(block.block_hash, k, m)] = proof
+
+    def get_suffix_proof(self, k: int, m: int):
+        # Returns the suffix proof of the current chain, it is only made from scratch if the
+        # cached one could not be shifted along when blocks were added
+        key = (self.blockchain.head.block_hash, k, m)
+        proof = self.suffix_cache.get(key)
+        if proof is None:
+            proof = nipopow.suffix_proof(self.blockchain, k, m, self.get_difficulty())
+            self.suffix_cache[key] = proof
+        return nipopow.copy_suffix_proof(proof)
     
+    def get_tree(self, block: bs.Block) -> MerkleTree:
+        # Returns the merkle tree of a block's txs, built trees of recently queried blocks are cached
+        mtree = self.tree_cache.get(block.block_hash)
+        if mtree is None:
+            mtree = MerkleTree()
+            for tx in block.txs:
+                mtree.addNode(tx.tx_id)  # Fill the merkle tree
+            print("\n|Full Node|")
+            mtree.initialize()
+            self.tree_cache.put(block.block_hash, mtree)
+        return mtree
+
+    def tree_cache_stats(self):
+        # hits/misses/evictions of the merkle tree cache
+        return self.tree_cache.stats()
+
     def get_path(self, tid: str):
         # Returns a dictionary with key pairs,
         # "blockid" : blockid
         # "path" : [List of hashes to hash together for verification]
-        curblock = self.blockchain.head
-        while curblock != None:
-            # Moving backwards through the blockchain
-            for block_transaction in curblock.txs:
-                if block_transaction.tx_id == tid:
-                    print("\n|Full Node|\n\tTransaction {t} found in block {b}".format(t=tid, b = curblock.height))
-                    mtree = MerkleTree()
-                    for tx in curblock.txs:
-                        mtree.addNode(tx.tx_id)  # Fill the merkle tree
-                    print("\n|Full Node|")
-                    mtree.initialize()
-                    mpath = mtree.get_path(tid)
-                    print("\tSending merkle path: {p}".format(p=mpath))
-                    return {
-                            "blockid": curblock.height,
-                            "path" : mpath
-                            }
-            curblock = curblock.prev_block
-    
+        location = self.blockchain.find_tx(tid)
+        if location is None:
+            return None
+        curblock, position = location
+        print("\n|Full Node|\n\tTransaction {t} found in block {b}".format(t=tid, b = curblock.height))
+        mtree = self.get_tree(curblock)
+        mpath = mtree.get_proof(position)
+        print("\tSending merkle path: {p}".format(p=mpath))
+        return {
+                "blockid": curblock.height,
+                "path" : mpath
+                }
+
+    def get_multipath(self, tids: List[str]):
+        # Returns one merkle multi-proof per block holding any of tids,
+        # [{"blockid": blockid, "leaf_count": number of txs, "indices": {tid: leaf index}, "hashes": [sibling hashes]}]
+        # tids that are not in the blockchain are left out
+        by_block = {}
+        for tid in tids:
+            location = self.blockchain.tx_index.get(tid)
+            if location is not None:
+                by_block.setdefault(location[0], []).append(tid)
+        proofs = []
+        for height in sorted(by_block, reverse=True):
+            curblock = self.blockchain.chain[height]
+            found = by_block[height]
+            print("\n|Full Node|\n\t{n} transactions found in block {b}".format(n=len(found), b=curblock.height))
+            mtree = self.get_tree(curblock)
+            mproof = mtree.get_multiproof(found)
+            print("\tSending {h} hashes for {n} transactions".format(h=len(mproof.hashes), n=len(found)))
+            proofs.append({
+                "blockid": curblock.height,
+                "leaf_count": mproof.leaf_count,
+                "indices": mproof.leaf_indices,
+                "hashes": mproof.hashes
+                })
+        return proofs
+
     def get_nipopow_proof(self, k, m, txn):
-        if not nipopow.find_txn_block(self.blockchain, txn):
+        if self.blockchain.find_tx(txn) is None:
             print(f"Transaction {txn} not found!")
             return False
-        return nipopow.infix_proof(self.blockchain, k, m, self.difficulty, txn)
+        key = (self.blockchain.head.block_hash, k, m)
+        if key not in self.suffix_cache:
+            self.get_suffix_proof(k, m)
+        return nipopow.infix_proof(self.blockchain, k, m, self.get_difficulty(), txn, self.suffix_cache[key])
+
+    def get_encoded_nipopow_proof(self, k, m, txn, mode=proof_codec.COMMITTED):
+        # The infix proof in the compact header-only wire format (see proof_codec)
+        proof = self.get_nipopow_proof(k, m, txn)
+        if not proof:
+            return False
+        return proof_codec.encode_proof(proof, mode)
+
+    def get_batch_nipopow_proof(self, k, m, txns):
+        # One infix proof for all txns, see nipopow.batch_infix_proof. Unknown txns get an empty predicate
+        key = (self.blockchain.head.block_hash, k, m)
+        if key not in self.suffix_cache:
+            self.get_suffix_proof(k, m)
+        return nipopow.batch_infix_proof(self.blockchain, k, m, self.get_difficulty(), txns, self.suffix_cache[key])
+
+    def get_encoded_batch_nipopow_proof(self, k, m, txns, mode=proof_codec.COMMITTED):
+        return proof_codec.encode_proof(self.get_batch_nipopow_proof(k, m, txns), mode)
 
     def get_top_chain(self, m: int, k: int, difficulty: int):
-        return nipopow.get_superchain(self.blockchain.chain, nipopow.find_top_chain(self.blockchain, m, difficulty, k), difficulty, k)
+        return nipopow.get_superchain(self.blockchain, nipopow.find_top_chain(self.blockchain, m, difficulty, k), difficulty, k)
 
     def print_blockchain_transactions(self):
         # Prints the current block chain, for use in testing systems
@@ -67,19 +156,22 @@ class FullNode:
 
     def store_blockchain_transactions(self, filename: str):
         # Writes blockchain to file at "Filename"
+        # (a text dump for reading, see blockstore.py for a store the chain can be reloaded from)
         curblock = self.blockchain.head
-        fp = open(filename, "w")
-        if not fp:
+        try:
+            fp = open(filename, "w")
+        except OSError:
             print("Could not write to file")
             return None
-        while curblock != None:
-            fp.write("\nBlock "+str(curblock.height)+":\n")
-            fp.write("\tTimestamp: {ts}\n".format(ts=curblock.header['timestamp']))
-            fp.write("\tNonce: {nn}\n".format(nn=curblock.nonce))
-            fp.write("\tMerkle Root: {mr}\n".format(mr=curblock.header['merkle']))
-            fp.write("\tTransactions \n\t{\n")
-            for tx in curblock.txs:
-                fp.write("\t"+str(tx.tx_id)+"\n")
-            fp.write("\t}\n\n")
-            curblock = curblock.prev_block
+        with fp:
+            while curblock != None:
+                fp.write("\nBlock "+str(curblock.height)+":\n")
+                fp.write("\tTimestamp: {ts}\n".format(ts=curblock.header['timestamp']))
+                fp.write("\tNonce: {nn}\n".format(nn=curblock.nonce))
+                fp.write("\tMerkle Root: {mr}\n".format(mr=curblock.header['merkle']))
+                fp.write("\tTransactions \n\t{\n")
+                for tx in curblock.txs:
+                    fp.write("\t"+str(tx.tx_id)+"\n")
+                fp.write("\t}\n\n")
+                curblock = curblock.prev_block
 
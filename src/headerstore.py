@@ -0,0 +1,88 @@
+"""
+Fixed-record header file for the SPV client, so it keeps its headers between runs.
+
+Every header is one RECORD of 68 bytes: merkle root 32 (a 20 byte sha1 root is padded with zeros)
+| nonce u64 | timestamp u64 | block hash 20. The header of height i is at i * RECORD.size, so
+headers[i] reads one record straight from the memory-mapped file: opening the store parses nothing
+and memory use does not grow with the number of headers.
+"""
+import mmap
+import os
+import struct
+import blockchain_structs as bs
+
+RECORD = struct.Struct(">32sQQ20s")
+_SHA1_PADDING = bytes(12)
+
+class HeaderStore:
+    """
+    Header list kept in the file at path. headers[i] returns the header of height i as a dictionary
+    {"merkle", "nonce", "timestamp", "hash"}, like Blockchain.headers with the block hash added.
+    sync(blockchain) appends the headers of the blocks it doesn't have yet.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        size = os.path.getsize(path)
+        self.count = size // RECORD.size
+        if size != self.count * RECORD.size:
+            # a header partly written when the client stopped
+            os.truncate(path, self.count * RECORD.size)
+        self.writer = open(path, "ab")
+        self.reader = open(path, "rb")
+        self.map = None
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.writer.close()
+        self.reader.close()
+
+    def __getitem__(self, height: int):
+        if height < 0:
+            height += self.count
+        if not 0 <= height < self.count:
+            raise IndexError(f"No header at height {height}")
+        if self.map is None or len(self.map) < self.count * RECORD.size:
+            # the headers appended since the file was mapped are not in the map yet
+            self.writer.flush()
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.reader.fileno(), 0, access=mmap.ACCESS_READ)
+        merkle_root, nonce, timestamp, block_hash = RECORD.unpack_from(self.map, height * RECORD.size)
+        if merkle_root.endswith(_SHA1_PADDING):
+            merkle_root = merkle_root[:20]
+        return {"merkle": merkle_root.hex(), "nonce": nonce, "timestamp": timestamp, "hash": block_hash.hex()}
+
+    def __iter__(self):
+        for height in range(self.count):
+            yield self[height]
+
+    def append_header(self, merkle_root: str, nonce: int, timestamp: int, block_hash: str):
+        self.writer.write(RECORD.pack(bytes.fromhex(merkle_root), nonce, timestamp, bs.digest_to_bytes(block_hash)))
+        self.count += 1
+
+    def append(self, block: bs.Block):
+        self.append_header(block.merkle_root, block.nonce, block.timestamp, block.block_hash)
+
+    def sync(self, blockchain: bs.Blockchain) -> int:
+        """ Appends the headers of the blocks above the last stored one, returns how many were added"""
+        last = min(self.count, len(blockchain.chain)) - 1
+        if last >= 0 and self[last]["hash"] != blockchain.chain[last].block_hash:
+            raise ValueError("Stored headers are not of this blockchain")
+        new_blocks = blockchain.chain[self.count:]
+        for block in new_blocks:
+            self.append(block)
+        self.writer.flush()
+        return len(new_blocks)
@@ -9,23 +9,163 @@ for each block, and fullnode.py to return a path to the lightclient.
 Used for reference: https://onuratakan.medium.com/what-is-the-merkle-tree-with-python-example-cbb4513b8ad0+
 """
 
+from bisect import bisect_right
 from hashlib import sha1
-import math
 
-class MerkleNode:
-    def __init__(self, value, rightNode, leftNode, content):
-        self.value = value # hashed 
-        self.rightNode = rightNode
-        self.leftNode = leftNode
-        self.content = content # transaction information, only in leaf nodes
-        self.parent = None
+# The trees keep their digests as 20 raw bytes, the hash_* functions below take and give the hex strings
+# used everywhere else (roots, paths and multi-proof hashes).
+def _leaf_digest(value) -> bytes:
+    return sha1(str(value).encode()).digest()
 
-    def set_parent(self, parentNode):
-        # sets a node parent, after tree is generated
-        self.parent = parentNode
+def _pair_digest(left: bytes, right: bytes) -> bytes:
+    # hash(1,2) must be the same as hash(2,1), see MerkleTree
+    return sha1(str(int.from_bytes(left, "big") + int.from_bytes(right, "big")).encode()).digest()
 
-    def get_value(self):
-        return self.value
+def _ordered_leaf_digest(value) -> bytes:
+    # the prefix keeps a leaf digest from ever passing for a node digest and the reverse
+    return sha1(b"\x00" + str(value).encode()).digest()
+
+def _ordered_pair_digest(left: bytes, right: bytes) -> bytes:
+    # unlike hash_pair, no sibling can be solved for that turns another leaf into the same parent
+    return sha1(b"\x01" + left + right).digest()
+
+def hash_leaf(value) -> str:
+    return _leaf_digest(value).hex()
+
+def hash_pair(left: str, right: str) -> str:
+    return _pair_digest(bytes.fromhex(left), bytes.fromhex(right)).hex()
+
+def hash_ordered_leaf(value) -> str:
+    return _ordered_leaf_digest(value).hex()
+
+def hash_ordered_pair(left: str, right: str) -> str:
+    return _ordered_pair_digest(bytes.fromhex(left), bytes.fromhex(right)).hex()
+
+def split_chunks(size: int):
+    """
+    Returns the perfect subtrees of a tree with size (even) leaves as (first leaf, height) pairs, left to right.
+    A subsection of the leaves is split so its right part is the largest 2^n < len(subsection), which
+    leaves a "spine" of left nodes with perfect subtrees hanging off it. The left most chunk is the
+    bottom pair of the spine, and chunk heights never decrease going right.
+    """
+    chunks = []
+    while size > 2:
+        height = size.bit_length() - 2 # right part gets 2^(floor(log2(size)) - 1) leaves
+        size -= 1 << height
+        chunks.append((size, height))
+    if size == 2:
+        chunks.append((0, 1))
+    chunks.reverse()
+    return chunks
+
+class MerkleProof:
+    """
+    Merkle path of one leaf, path is bottom up (the first digest is hashed with the leaf). hash_pair is
+    the one of the tree the path was taken from.
+    """
+    def __init__(self, leaf_index, value, leaf, path, root, leaf_count, hash_pair=hash_pair):
+        self.leaf_index = leaf_index
+        self.value = value
+        self.leaf = leaf # digest of value
+        self.path = path
+        self.root = root # root of the tree the path was taken from
+        self.leaf_count = leaf_count # number of leaves in the tree (without the padding leaf)
+        self.hash_pair = hash_pair
+
+    def compute_root(self) -> str:
+        # each sibling is hashed on its side of the path, which only matters for an ordered hash_pair
+        chunks = split_chunks(self.leaf_count + self.leaf_count % 2)
+        chunk = bisect_right([start for start, _ in chunks], self.leaf_index) - 1
+        start, height = chunks[chunk]
+        on_left = [((self.leaf_index - start) >> level) & 1 == 1 for level in range(height)]
+        on_left += [True] * (chunk > 0) + [False] * (len(chunks) - chunk - 1) # the spine, then the chunks right of it
+        if len(on_left) != len(self.path):
+            return None
+        hashed = self.leaf
+        for sibling, left in zip(self.path, on_left):
+            hashed = self.hash_pair(sibling, hashed) if left else self.hash_pair(hashed, sibling)
+        return hashed
+
+    def verify(self, root: str) -> bool:
+        return self.compute_root() == root
+
+class MerkleMultiProof:
+    """
+    Proof for several leaves of one tree. hashes holds every sibling digest needed by any of the
+    leaves once, in the order multiproof_root() consumes them. hash_leaf and hash_pair are the tree's.
+    """
+    def __init__(self, leaf_count, leaf_indices, hashes, root, hash_leaf=hash_leaf, hash_pair=hash_pair):
+        self.leaf_count = leaf_count # number of leaves in the tree (without the padding leaf)
+        self.leaf_indices = leaf_indices # value -> leaf index
+        self.hashes = hashes
+        self.root = root
+        self.hash_leaf = hash_leaf
+        self.hash_pair = hash_pair
+
+    def compute_root(self) -> str:
+        leaves = {index: self.hash_leaf(value) for value, index in self.leaf_indices.items()}
+        return multiproof_root(self.leaf_count, leaves, self.hashes, self.hash_pair)
+
+    def verify(self, root: str) -> bool:
+        return self.compute_root() == root
+
+def _fold_multiproof(leaf_count, leaves, get_node, get_spine, combine=hash_pair):
+    """
+    Computes the root of a tree of leaf_count leaves from the known leaves {index: digest}, walking the
+    same chunks as MerkleTree and joining nodes with combine. Each node outside the paths is asked for
+    once: get_node(height, first leaf) for a sibling inside a chunk, get_spine(chunk) for the whole spine
+    left of the first chunk with a known leaf.
+    """
+    if not leaves:
+        return None
+    leaves = dict(leaves)
+    if leaf_count % 2 == 1 and leaf_count - 1 in leaves:
+        leaves[leaf_count] = leaves[leaf_count - 1] # the duplicated last leaf
+    digest = None
+    for chunk, (start, height) in enumerate(split_chunks(leaf_count + leaf_count % 2)):
+        nodes = {index - start: leaf for index, leaf in leaves.items() if start <= index < start + (1 << height)}
+        if not nodes:
+            if digest is not None:
+                digest = combine(digest, get_node(height, start))
+            continue
+        if digest is None and chunk > 0:
+            digest = get_spine(chunk - 1)
+        for level in range(height):
+            parents = {}
+            for index in sorted(nodes):
+                if index >> 1 in parents:
+                    continue
+                sibling = nodes.get(index ^ 1)
+                if sibling is None:
+                    sibling = get_node(level, start + ((index ^ 1) << level))
+                pair = (nodes[index], sibling) if index % 2 == 0 else (sibling, nodes[index])
+                parents[index >> 1] = combine(*pair)
+            nodes = parents
+        digest = nodes[0] if digest is None else combine(digest, nodes[0])
+    return digest
+
+class _MissingHash(Exception):
+    pass
+
+def multiproof_root(leaf_count: int, leaves, hashes, combine=hash_pair) -> str:
+    """
+    Root of a tree with leaf_count leaves given the known leaves {index: digest} and a multi-proof's hashes,
+    combine is the tree's hash_pair (hash_ordered_pair for an OrderedMerkleTree). Returns None if the proof doesn't fit the tree: a leaf outside it, too few hashes or hashes left over.
+    """
+    if leaf_count < 1 or any(not 0 <= index < leaf_count for index in leaves):
+        return None
+    used = 0
+    def take(*_):
+        nonlocal used
+        if used >= len(hashes):
+            raise _MissingHash()
+        used += 1
+        return hashes[used - 1]
+    try:
+        root = _fold_multiproof(leaf_count, leaves, take, take, combine)
+    except _MissingHash:
+        return None
+    return root if used == len(hashes) else None
 
 class MerkleTree:
     """ 
@@ -36,7 +176,7 @@ class MerkleTree:
         2. The user must call initialize() after all nodes are appended
         3. Hashing values together is done in a few steps:
                 Step 1: Convert hash strings to integers
-                Step 2: Combine using bitwise OR "|"
+                Step 2: Combine using addition "+"
                 Step 3: Convert back to string and hash
             This must be done this way because hash(1,2) must be the same as hash(2,1) for the proof
             to be accessible
@@ -52,97 +192,226 @@ class MerkleTree:
                     /   \        /   \             
                 Hash0  Hash1  Hash2  Hash3     
 
+    The tree is stored as flat lists of 20 byte digests, one per level (level 0 are the leaves), which are
+    turned into hex strings only when they leave the tree (root, paths, multi-proofs). Because of the
+    split in 5., the nodes of level j only exist from some leaf onwards (level_starts[j]), after which
+    each node covers the next 2^j leaves. The perfect subtrees ("chunks") are joined left to right along
+    the spine, spine[c] being the digest over chunks 0..c and spine[-1] the root.
     """
+    hash_leaf = staticmethod(hash_leaf)
+    hash_pair = staticmethod(hash_pair)
+    _leaf_digest = staticmethod(_leaf_digest)
+    _pair_digest = staticmethod(_pair_digest)
+
     def __init__(self):
-        self.nodes = [] # holds all nodes
-        self.root = None # head node
+        self.leaves = [] # leaf digests (bytes)
+        self.contents = [] # leaf values, same order as the leaves
+        self.leaf_index = {} # value -> index of its leaf, a repeated value maps to its last leaf
+        self.levels = [] # levels[j] holds the digests of the level j nodes
+        self.level_starts = [] # first leaf covered by levels[j][0]
+        self.chunks = [] # (first leaf, height) of each perfect subtree, see split_chunks
+        self.chunk_starts = []
+        self.spine = []
+        self.root = None # root digest (hex)
     
     def addNode(self, nodeValue):
         # adds a node to the list, NOT the tree
-        hashedvalue = sha1(str(nodeValue).encode()).hexdigest()
-        newnode = MerkleNode(hashedvalue, None, None, nodeValue)
-        self.nodes.append(newnode)
+        self.leaf_index[nodeValue] = len(self.leaves)
+        self.leaves.append(self._leaf_digest(nodeValue))
+        self.contents.append(nodeValue)
 
-    def initialize(self):
+    def initialize(self, verbose=True):
         # Once all nodes are appended, run initialize
-        if len(self.nodes) % 2 == 1:
-            self.nodes.append(self.nodes[(len(self.nodes)-1)])
-        print("\tGenerating Merkle Tree...")
-        self.root = self._generatetree(self.nodes)
-        self._set_parents(self.root)
-        if self.root:
-            print("\tMerkle Tree Generated with root: {s}".format(s = self.root.get_value()))
+        leaves = self.leaves.copy()
+        if len(leaves) % 2 == 1:
+            leaves.append(leaves[-1])
+        if verbose:
+            print("\tGenerating Merkle Tree...")
+        self._generatetree(leaves)
+        if self.root and verbose:
+            print("\tMerkle Tree Generated with root: {s}".format(s = self.root))
     
-    def _generatetree(self, nodeSubSection):
-        # Recursive function that generates a merkle tree given a subsection of nodes
-        # Starts with the full list of nodes, generating nodes top-down
-        # Based loosely on the implementation by https://onuratakan.medium.com/what-is-the-merkle-tree-with-python-example-cbb4513b8ad0
-
-        if len(nodeSubSection) == 0:
+    def _generatetree(self, leaves):
+        # Builds the tree bottom-up one level at a time, only hashing the nodes that exist on each level
+        self.levels = [leaves]
+        self.level_starts = [0]
+        self.chunks = split_chunks(len(leaves))
+        self.chunk_starts = [start for start, _ in self.chunks]
+        self.spine = []
+        self.root = None
+        if not leaves:
             # tree was initialized with no nodes
             return
-        # split_id is the point to split the subsection
-        split_id = len(nodeSubSection) - (2**int((math.log(len(nodeSubSection),2))//1))//2 # split into largest n division of 2^n
-        if len(nodeSubSection) == 2:
-            concatenated = int(nodeSubSection[0].get_value(),16) + int(nodeSubSection[1].get_value(),16)
-            newhash = sha1(str(concatenated).encode()).hexdigest()
-            newNode = MerkleNode(newhash, nodeSubSection[1], nodeSubSection[0], None)
-            return newNode
-        left = self._generatetree(nodeSubSection[:split_id]) # call recursively on left "half"
-        right = self._generatetree(nodeSubSection[split_id:]) # call recursively on right "half"
-        concatenated = str(int(left.get_value(),16) + int(right.get_value(),16))
-        value = sha1(concatenated.encode()).hexdigest()
-        return MerkleNode(value, right, left, None)
-
-    def _set_parents(self, node):
-    # recursive function to set the parent of all nodes
-        if node != None:
-            if node.leftNode != None:
-                node.leftNode.set_parent(node)
-                node.rightNode.set_parent(node)
-                self._set_parents(node.leftNode)
-                self._set_parents(node.rightNode)
-
-    def _get_sibling(self, node):
-        # Returns the node's sibling (parents other child)
-        if node != None:
-            if node.parent != None:
-                if node.parent.leftNode == node:
-                    # node is parent's left node, sibling on right
-                    return node.parent.rightNode
-                else:
-                    # node is parent's right node, sibling on left
-                    return node.parent.leftNode
+        for height in range(1, self.chunks[-1][1] + 1):
+            start = next(first for first, chunk_height in self.chunks if chunk_height >= height)
+            below = self.levels[-1]
+            first = (start - self.level_starts[-1]) >> (height - 1) # index of the first child in the level below
+            self.levels.append([self._pair_digest(below[i], below[i + 1]) for i in range(first, len(below), 2)])
+            self.level_starts.append(start)
+        digest = None
+        for start, height in self.chunks:
+            node = self._get_node(height, start)
+            digest = node if digest is None else self._pair_digest(digest, node)
+            self.spine.append(digest)
+        self.root = digest.hex()
+
+    def _get_node(self, height, first_leaf):
+        # Returns the digest of the node at the given level whose left most leaf is first_leaf
+        return self.levels[height][(first_leaf - self.level_starts[height]) >> height]
+
+    def get_proof(self, index):
+        # Returns the merkle path of the leaf at index, bottom up. Needs an initialized tree
+        chunk = bisect_right(self.chunk_starts, index) - 1
+        start, height = self.chunks[chunk]
+        path = []
+        for level in range(height):
+            # sibling inside the chunk, its subtree is the neighbouring block of 2^level leaves
+            sibling = start + ((((index - start) >> level) ^ 1) << level)
+            path.append(self._get_node(level, sibling).hex())
+        if chunk > 0:
+            path.append(self.spine[chunk - 1].hex())
+        for right_start, right_height in self.chunks[chunk + 1:]:
+            path.append(self._get_node(right_height, right_start).hex())
+        return path
 
     def get_path(self, value):
-        # Returns an array of all strings to be hashed with initial value to get to the root
-        valueNode = None # Identifies the node that contains the content == value
-        returnstrings = [] # Merkle path
-        for node in self.nodes:
-            if node.content == value:  # Found a node with matching value
-                valueNode = node
-        if valueNode == None:
-            if len(self.nodes) == 0:
-                return "Tree is empty/uninitialized"
-            return "No matching value in tree for " + str(value)
-        while valueNode.parent != None:
-            returnstrings.append(self._get_sibling(valueNode).value)
-            valueNode = valueNode.parent
-        return returnstrings
+        """
+        Returns the MerkleProof for the leaf holding value, or None if value was never added or
+        the tree is empty/uninitialized. When the number of leaves is odd the last leaf is its own
+        sibling (the duplicate only exists in the tree, it is never looked up).
+        """
+        index = self.leaf_index.get(value)
+        if index is None or self.root is None:
+            return None
+        return MerkleProof(index, value, self.leaves[index].hex(), self.get_proof(index), self.root, len(self.leaves), self.hash_pair)
+
+    def get_multiproof(self, values):
+        """
+        Returns one MerkleMultiProof covering all values, sibling digests shared by several paths (or
+        on another value's path) are only included once. None if any value is not in the tree.
+        """
+        indices = {}
+        for value in values:
+            index = self.leaf_index.get(value)
+            if index is None or self.root is None:
+                return None
+            indices[value] = index
+        return MerkleMultiProof(len(self.leaves), indices, self.get_multiproof_hashes(indices.values()), self.root,
+            self.hash_leaf, self.hash_pair)
+
+    def get_multiproof_hashes(self, indices):
+        # The sibling digests proving the leaves at indices together, in the order multiproof_root() reads them
+        hashes = []
+        def get_node(height, first_leaf):
+            hashes.append(self._get_node(height, first_leaf).hex())
+            return hashes[-1]
+        def get_spine(chunk):
+            hashes.append(self.spine[chunk].hex())
+            return hashes[-1]
+        _fold_multiproof(len(self.leaves), {index: self.leaves[index].hex() for index in indices}, get_node, get_spine, self.hash_pair)
+        return hashes
+
+class OrderedMerkleTree(MerkleTree):
+    """
+    MerkleTree with ordered, domain separated hashing (hash_ordered_leaf / hash_ordered_pair). The
+    additive hash_pair lets anyone solve for a sibling that proves a made up leaf under a real root, so
+    trees whose multi-proofs are checked against a commitment, like the interlink's, use this one.
+    """
+    hash_leaf = staticmethod(hash_ordered_leaf)
+    hash_pair = staticmethod(hash_ordered_pair)
+    _leaf_digest = staticmethod(_ordered_leaf_digest)
+    _pair_digest = staticmethod(_ordered_pair_digest)
         
 
+class IncrementalMerkleTree:
+    """
+    Append-only merkle tree for block templates that fill up one transaction at a time. The root is
+    updated on every append and is the same as MerkleTree.initialize() over the same leaves.
+
+    The split of MerkleTree puts the tree of size - 2^h leaves left of a last perfect subtree of 2^h
+    leaves (h = size.bit_length() - 2), so the root of every even size is kept in roots and an append
+    only needs that last chunk. The chunk slides along the leaves as the tree grows, so the digest of
+    every complete subtree inside it is kept in nodes[height][first leaf] and reused when a later
+    chunk covers it again, which makes an append hash O(log n) new nodes amortized.
+
+    Later chunks never start left of _live_from(size), so roots and subtrees left of it are dropped.
+    A sweep runs once more entries were added than the last one kept, so it is O(1) amortized and at
+    most twice the entries later appends can use are held (still up to about n/2 per level).
+    """
+    def __init__(self):
+        self.leaves = [] # leaf digests (bytes), like MerkleTree
+        self.nodes = [{}] # nodes[height][first leaf] -> digest, never holds a subtree with the padding leaf
+        self.roots = {} # even number of leaves -> root digest of the tree of those leaves
+        self.root = None # hex
+        self._added = 0 # entries added to nodes and roots since the last sweep
+        self._kept = 0 # entries the last sweep kept
+
+    def __len__(self):
+        return len(self.leaves)
+
+    def append(self, value) -> str:
+        # Adds a leaf and returns the new root
+        self.leaves.append(_leaf_digest(value))
+        size = len(self.leaves)
+        padded = size + size % 2
+        if padded == 2:
+            digest = self._get_node(1, 0)
+        else:
+            height = padded.bit_length() - 2
+            start = padded - (1 << height)
+            digest = _pair_digest(self.roots[start], self._get_node(height, start))
+        if size == padded:
+            self.roots[size] = digest
+            self._added += 1
+        self.root = digest.hex()
+        if self._added > max(self._kept, 64):
+            self._sweep()
+        return self.root
+
+    @staticmethod
+    def _live_from(size: int) -> int:
+        # first leaf of the leftmost last chunk of any tree of size or more leaves: the chunk start
+        # grows with the size and falls back to 2^(bits - 1) at the next power of two
+        padded = size + size % 2
+        if padded <= 2:
+            return 0
+        bits = padded.bit_length()
+        return min(padded - (1 << (bits - 2)), 1 << (bits - 1))
+
+    def _sweep(self):
+        live = self._live_from(len(self.leaves) + 1)
+        self.roots = {size: root for size, root in self.roots.items() if size >= live}
+        self.nodes = [{start: digest for start, digest in level.items() if start >= live} for level in self.nodes]
+        self._kept = len(self.roots) + sum(len(level) for level in self.nodes)
+        self._added = 0
+
+    def _get_node(self, height, first_leaf):
+        size = len(self.leaves)
+        if height == 0:
+            # past the last leaf is the duplicate of an odd last leaf
+            return self.leaves[min(first_leaf, size - 1)]
+        while len(self.nodes) <= height:
+            self.nodes.append({})
+        digest = self.nodes[height].get(first_leaf)
+        if digest is None:
+            half = 1 << (height - 1)
+            digest = _pair_digest(self._get_node(height - 1, first_leaf), self._get_node(height - 1, first_leaf + half))
+            if first_leaf + (1 << height) <= size:
+                self.nodes[height][first_leaf] = digest
+                self._added += 1
+        return digest
+
 if __name__ == "__main__":
     """ Used for Testing """
     mtree = MerkleTree()
     for i in range(1,90): # Generates 70 nodes of values of single integers
         mtree.addNode(i)
     mtree.initialize()
-    print("Root: "+ mtree.root.get_value()) # Root hash value
-    hashed = sha1(str(5).encode()).hexdigest()
-    for hash in mtree.get_path(5):
+    print("Root: "+ mtree.root) # Root hash value
+    hashed = hash_leaf(5)
+    for hash in mtree.get_path(5).path:
         print(hash)
-        concatenated = str(int(hashed, 16) + int(hash, 16))
-        hashed = sha1(concatenated.encode()).hexdigest()
+        hashed = hash_pair(hashed, hash)
     print("Proven: " + hashed) # Hash value given from hashing together path
     # if Proven and Root give the same integer, the system works!
 
@@ -2,10 +2,15 @@ from gettext import find
 from typing import *
 import blockchain_structs as bs
 from hashlib import sha1
-from ecdsa import SigningKey, VerifyingKey, NIST192p
+from ecdsa import SigningKey, VerifyingKey, NIST192p, BadSignatureError
+from ecdsa.errors import MalformedPointError
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing
+import os
 import random
 import json
 import nipopow
+from cache import LRUCache
 
 # pre-generated addresses
 # (priv, pub)
@@ -21,40 +26,279 @@ ADDRESSES = [('765353b3e107ad026219295db145cf93fc7462879b745988',
 
 LIGHT_CLIENT_ADDRESS = None
 
-# def verify_UTXO(utxo: bs.UTXO, utxo_set: List[bs.UTXO]) -> bool:
-#     """
-#     Checks that both the the UTXO signature is valid, and that the UTXO resides
-#     in the UTXO set.
-#     """
-#     # First check the utxo resides in the set
-#     if utxo not in utxo_set:
-#         return False
-#     # Second, verify if the signature is valid
-#     prove_message = utxo.get_message().to_json().encode()
-#     verif_key = VerifyingKey.from_string(bytearray.fromhex(utxo.pub_key), curve=NIST192p)
-#     decoded_sig = bytes.fromhex(utxo.sig)
-#     try:
-#         return verif_key.verify(decoded_sig, prove_message)
-#     except:
-#         return False
+# (pub key, sha1 digest of the message, signature) of signatures found valid, so a tx input checked
+# once (ie. before its tx was in a block) is not verified again
+SIGNATURE_CACHE_SIZE = 65536
+verified_signatures = LRUCache(SIGNATURE_CACHE_SIZE)
+
+def _signature_id(pub_key: str, message: bytes, sig: bytes):
+    return pub_key, sha1(message).digest(), sig
+
+def verify_signature(pub_key: str, message: bytes, sig: bytes) -> bool:
+    """ Checks that sig is a signature of message by the (hex) public key pub_key"""
+    signature_id = _signature_id(pub_key, message, sig)
+    if verified_signatures.get(signature_id):
+        return True
+    try:
+        valid = bs.verifying_key(pub_key).verify(sig, message)
+    except (BadSignatureError, MalformedPointError, ValueError):
+        return False
+    if valid:
+        verified_signatures.put(signature_id, True)
+    return valid
+
+def signature_cache_stats():
+    return verified_signatures.stats()
+
+def verify_UTXO(utxo: bs.UTXO, utxo_set: bs.UTXOSet) -> bool:
+    """
+    Checks that both the the UTXO signature is valid, and that the UTXO resides
+    in the UTXO set.
+    """
+    # First check the utxo resides in the set
+    output = utxo_set.get(utxo.id)
+    if output is None or (output.val, output.pub_key) != (utxo.val, utxo.pub_key):
+        return False
+    # Second, verify if the signature is valid
+    return verify_signature(output.pub_key, utxo.signing_message(), bytes.fromhex(utxo.sig))
+
+def input_signatures(block: bs.Block, utxo_set: bs.UTXOSet):
+    """
+    Checks that the inputs of the block's txs are unspent outputs (in utxo_set or made by an earlier tx
+    of the block) spent once, and that no tx pays out more than its inputs hold. Returns the
+    (pub key, message, signature) of every input, to be checked by verify_signature, or None if the
+    inputs are not valid.
+    """
+    created = {} # outputs of the block's txs, their ids are only set once the block is added
+    spent = set()
+    signatures = []
+    for tx in block.txs:
+        if not tx.vin: # coinbase
+            created.update(((tx.tx_id, index), utxo) for index, utxo in enumerate(tx.vout))
+            continue
+        value = 0
+        for utxo in tx.vin:
+            outpoint = utxo.id
+            output = created.get(outpoint) or utxo_set.get(outpoint)
+            if output is None or outpoint in spent or (output.val, output.pub_key) != (utxo.val, utxo.pub_key):
+                return None
+            spent.add(outpoint)
+            value += output.val
+            signatures.append((output.pub_key, utxo.signing_message(), bytes.fromhex(utxo.sig)))
+        if sum(utxo.val for utxo in tx.vout) > value:
+            return None
+        created.update(((tx.tx_id, index), utxo) for index, utxo in enumerate(tx.vout))
+    return signatures
+
+def verify_block(block: bs.Block, utxo_set: bs.UTXOSet, pool: "VerifierPool" = None) -> bool:
+    """
+    Checks the block's inputs against utxo_set (the UTXO set of the chain it extends) and verifies
+    their signatures, with pool (a VerifierPool) if one is given or one by one in this process.
+    """
+    signatures = input_signatures(block, utxo_set)
+    if signatures is None:
+        return False
+    if pool is None:
+        return all(verify_signature(*signature) for signature in signatures)
+    # the workers have caches of their own, only signatures not verified here before are sent
+    unverified = {}
+    for signature in signatures:
+        signature_id = _signature_id(*signature)
+        if not verified_signatures.get(signature_id):
+            unverified[signature_id] = signature
+    if not pool.verify(list(unverified.values())):
+        return False
+    for signature_id in unverified:
+        verified_signatures.put(signature_id, True)
+    return True
+
+def pow_target(difficulty: int) -> bytes:
+    """ Returns the difficulty as a 20 byte big endian string so digests can be compared directly"""
+    return min(difficulty, 2**160 - 1).to_bytes(20, "big")
 
 def find_pow(block: bs.Block, difficulty: int) -> bs.Block:
-    serial_block = block.to_json().encode()
-    pow_hash = sha1(serial_block)
-    while (int(pow_hash.hexdigest(), 16) > difficulty):
-        block.set_nonce(block.nonce + 1)
-        serial_block = block.to_json().encode()
-        pow_hash = sha1(serial_block)
-    block.set_block_hash(pow_hash.hexdigest())
+    """
+    Searches nonces until the header hash is <= difficulty. The header prefix is hashed once and
+    each attempt only copies that midstate and feeds in the 8 nonce bytes.
+    """
+    midstate = sha1(block.get_header_prefix())
+    target = pow_target(difficulty)
+    pack_nonce = bs.HEADER_NONCE.pack
+    nonce = block.nonce
+    while True:
+        attempt = midstate.copy()
+        attempt.update(pack_nonce(nonce))
+        digest = attempt.digest()
+        if digest <= target:
+            break
+        nonce += 1
+    block.set_nonce(nonce)
+    block.set_block_hash(digest.hex())
+    block.set_level(difficulty)
     # print("\n|Miner|")
-    # print(f"\tSolution found with nonce {block.nonce} with digest {pow_hash.hexdigest()}\n")
+    # print(f"\tSolution found with nonce {block.nonce} with digest {digest.hex()}\n")
     return block
 
+# Sentinel for "no range has a solution yet", larger than any range id
+_NO_SOLUTION = 2**62
+# How many nonces a worker tries between checks for a solution in a lower range
+_CANCEL_CHECK = 4096
+# Set in each pool worker by _init_mining_worker, holds the lowest range id with a known solution
+_solved_range = None
+
+def _init_mining_worker(solved_range):
+    global _solved_range
+    _solved_range = solved_range
+
+def _search_nonce_range(prefix: bytes, target: bytes, range_id: int, start: int, stop: int):
+    """
+    Searches nonces in [start, stop) for a header hash <= target. Returns (nonce, digest) or None.
+    Gives up early once a lower range already has a solution, since that one will be used.
+    """
+    midstate = sha1(prefix)
+    pack_nonce = bs.HEADER_NONCE.pack
+    for nonce in range(start, stop):
+        if nonce % _CANCEL_CHECK == 0 and _solved_range is not None and _solved_range.value < range_id:
+            return None
+        attempt = midstate.copy()
+        attempt.update(pack_nonce(nonce))
+        digest = attempt.digest()
+        if digest <= target:
+            return nonce, digest
+    return None
+
+class MiningPool:
+    """
+    Process pool for proof of work. A search is split into consecutive nonce ranges that the workers
+    take in order. When a range has a solution, ranges above it are cancelled and the ones below it are
+    finished, so the lowest solving nonce is returned, exactly as find_pow would.
+
+    Use as a context manager (or call close()) so the worker processes are shut down.
+    """
+    def __init__(self, workers: int = None, range_size: int = 2**16, local_attempts: int = 2**12) -> None:
+        self.workers = workers or os.cpu_count()
+        self.range_size = range_size
+        self.local_attempts = local_attempts # tried in this process first, easy difficulties never reach the pool
+        self._solved_range = multiprocessing.Value("q", _NO_SOLUTION)
+        self._executor = ProcessPoolExecutor(self.workers, initializer=_init_mining_worker,
+            initargs=(self._solved_range,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+    def find_pow(self, block: bs.Block, difficulty: int) -> bs.Block:
+        prefix = block.get_header_prefix()
+        target = pow_target(difficulty)
+        start = block.nonce + self.local_attempts
+        solution = _search_nonce_range(prefix, target, -1, block.nonce, start)
+        if solution is None:
+            solution = self._search(prefix, target, start)
+        nonce, digest = solution
+        block.set_nonce(nonce)
+        block.set_block_hash(digest.hex())
+        block.set_level(difficulty)
+        return block
+
+    def _search(self, prefix: bytes, target: bytes, start: int):
+        self._solved_range.value = _NO_SOLUTION
+        pending = {} # future -> range id
+        next_range = 0
+        best_range, best = _NO_SOLUTION, None
+        while True:
+            # keep every worker busy with ranges that could still hold the lowest solution
+            while len(pending) < 2 * self.workers and next_range < best_range:
+                range_start = start + next_range * self.range_size
+                future = self._executor.submit(_search_nonce_range, prefix, target, next_range,
+                    range_start, range_start + self.range_size)
+                pending[future] = next_range
+                next_range += 1
+            if not pending:
+                return best
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                range_id = pending.pop(future)
+                if future.cancelled():
+                    continue
+                result = future.result()
+                if result is not None and range_id < best_range:
+                    best_range, best = range_id, result
+                    self._solved_range.value = range_id
+            for future in [f for f, range_id in pending.items() if range_id > best_range]:
+                # running ranges above the solution stop at their next check
+                future.cancel()
+
+# Set in each verifier worker by _init_verify_worker, nonzero once a signature of the batch is invalid
+_batch_failed = None
+
+def _init_verify_worker(batch_failed):
+    global _batch_failed
+    _batch_failed = batch_failed
+
+def _verify_signatures(signatures) -> bool:
+    """ Verifies a chunk of signatures, stops at the first invalid one or once another chunk had one"""
+    for signature in signatures:
+        if _batch_failed is not None and _batch_failed.value:
+            return False
+        if not verify_signature(*signature):
+            return False
+    return True
+
+class VerifierPool:
+    """
+    Process pool for signature verification. verify(signatures) splits the (pub key, message, signature)
+    tuples into chunks for the workers. The first invalid signature cancels the chunks not started yet
+    and stops the running ones at their next signature, since the answer is known.
+
+    Use as a context manager (or call close()) so the worker processes are shut down.
+    """
+    def __init__(self, workers: int = None, chunk_size: int = 32) -> None:
+        self.workers = workers or os.cpu_count()
+        self.chunk_size = chunk_size
+        self._batch_failed = multiprocessing.Value("b", 0)
+        self._executor = ProcessPoolExecutor(self.workers, initializer=_init_verify_worker,
+            initargs=(self._batch_failed,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+    def verify(self, signatures) -> bool:
+        """ Returns whether every signature is valid"""
+        if not signatures:
+            return True
+        self._batch_failed.value = 0
+        # smaller chunks when there are few signatures, so every worker gets some
+        size = max(1, min(self.chunk_size, -(-len(signatures) // self.workers)))
+        pending = {self._executor.submit(_verify_signatures, signatures[start:start + size])
+            for start in range(0, len(signatures), size)}
+        valid = True
+        while pending and valid:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            valid = all(future.result() for future in done)
+        if not valid:
+            self._batch_failed.value = 1
+            for future in pending:
+                future.cancel()
+            # running chunks return at their next signature, the flag is reset for the next batch after that
+            wait(pending)
+        return valid
+
 def get_tx_hash(tx: bs.Transaction):
-    return sha1(json.dumps(tx, indent = 4, default=lambda o: o.__dict__)).hexdigest()
+    return tx.get_hash()
 
 def get_block_hash(block: bs.Block):
-    return sha1(json.dumps(block, indent = 4, default=lambda o: o.__dict__).encode()).hexdigest()
+    return sha1(json.dumps(block, indent = 4, default=bs.json_default).encode()).hexdigest()
 
 def create_coinbase_tx(pubkey, value):
     coinbase = bs.UTXO(value, pubkey)
@@ -72,36 +316,34 @@ def disperse_coinbase(addresses: List[Tuple], utxo: bs.UTXO):
         vout.append(bs.UTXO(ds_amount, addresses[i][1]))
     return bs.Transaction(vin, vout).set_tx_id()
 
-def create_txs(block: bs.Block, rounds):
+def create_txs(utxo_set: bs.UTXOSet, rounds):
     """ 
-    Takes in previous block and number of transactions desired to create.
+    Takes in the chain's UTXO set and number of transactions desired to create.
     This function creates a list of new transactions between senders
-    in the address book. I don't really want to create functions that keep
-    track of the UTXO set so every transactions deals with vouts from the previous block.
+    in the address book, each spending one of the sender's unspent outputs.
+    The outputs stay in utxo_set until the block holding the txs is added to the chain.
     """
     tx_list = []
     for i in range(len(ADDRESSES)):
         priv_key = ADDRESSES[i][0]
         pub_key = ADDRESSES[i][1]
         add_list = [key for key in ADDRESSES if key != ADDRESSES[i]]
-        utxos = []
-        # find utxos for given address
-        for tx in block.txs:
-            for utxo in tx.vout:
-                if utxo.pub_key == pub_key:
-                    utxos.append(utxo)
+        # utxos for given address
+        utxos = utxo_set.unspent(pub_key)
         # rounds is the number of times each address creates tx to other addresses
         for i in range(rounds):
             # if utxo list is empty stop making txs from curr address
             if not utxos:
                 break
-            curr_utxo = random.choice(utxos)
+            # swap the chosen utxo to the end so removing it is O(1)
+            pick = random.randrange(len(utxos))
+            utxos[pick], utxos[-1] = utxos[-1], utxos[pick]
+            curr_utxo = utxos.pop()
             curr_utxo.sign_utxo(priv_key)
             send_utxo = bs.UTXO(random.randint(1, curr_utxo.val), random.choice(add_list)[1])
             vin = [curr_utxo]
             vout = [send_utxo]
             tx_list.append(bs.Transaction(vin, vout).set_tx_id())
-            utxos.remove(curr_utxo)
     return tx_list
 
 def output_chain(blockchain: bs.Blockchain):
@@ -112,8 +354,19 @@ def output_blockhashes(blockchain: bs.Blockchain):
     for block in blockchain.chain:
         print(f"Block {block.height}: {block.block_hash}")
 
-def generate_blockchain(block_num, coinbase, difficulty):
-    block_chain = bs.Blockchain(coinbase, difficulty)
+def generate_blockchain(block_num, coinbase, difficulty, workers: int = 1, store = None):
+    """
+    Mines a chain of block_num blocks (plus the genesis and first block). With workers > 1 every
+    block is mined by a MiningPool of that many processes, the resulting chain is the same.
+    Blocks are also written to store (a blockstore.BlockStore) if one is given.
+    """
+    if workers > 1:
+        with MiningPool(workers) as pool:
+            return _build_blockchain(block_num, coinbase, difficulty, pool.find_pow, store)
+    return _build_blockchain(block_num, coinbase, difficulty, find_pow, store)
+
+def _build_blockchain(block_num, coinbase, difficulty, find_pow, store = None):
+    block_chain = bs.Blockchain(coinbase, difficulty, store)
     # create and add genesis block
     genesis = bs.Block(None, [], 0)
     genesis = find_pow(genesis, difficulty)
@@ -123,6 +376,7 @@ def generate_blockchain(block_num, coinbase, difficulty):
     address_book = ADDRESSES # list of all the addresses
     # creates the first block (when no UTXOs exist yet)
     first_coinbase = create_coinbase_tx(miner_pub_key, coinbase)
+    bs.set_utxo_txid([first_coinbase]) # the coinbase is spent in its own block, its id is part of the signed message
     disperse_cb = disperse_coinbase(address_book, first_coinbase.vout[0])
     first_tx_list = [first_coinbase, disperse_cb]
     premine_block = bs.Block(block_chain.head, first_tx_list, block_chain.height+1)
@@ -134,8 +388,10 @@ def generate_blockchain(block_num, coinbase, difficulty):
     for i in range(block_num):
         tx_list = []
         tx_list.append(create_coinbase_tx(miner_pub_key, coinbase))
-        tx_list.append(disperse_coinbase(address_book, block_chain.head.txs[0].vout[0]))
-        tx_list = tx_list + create_txs(block_chain.head, 10) # unpacks list returned from create_txs
+        prev_coinbase = block_chain.head.txs[0].vout[0]
+        if prev_coinbase.id in block_chain.utxos: # the first block spends its own coinbase already
+            tx_list.append(disperse_coinbase(address_book, prev_coinbase))
+        tx_list = tx_list + create_txs(block_chain.utxos, 10) # unpacks list returned from create_txs
         new_block = bs.Block(block_chain.head, tx_list , block_chain.height+1)
         print("TXN NUM:", len(new_block.txs))
         new_block.interlink = nipopow.Interlink(genesis)
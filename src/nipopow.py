@@ -1,6 +1,7 @@
 from typing import *
 import blockchain_structs
 import copy
+import merkle
 import miner
 
 class Interlink:
@@ -20,13 +21,36 @@ class Interlink:
     There are log(n) (for a chain with n blocks) pointers per block. The interlink data struct changes per block based
     on the previous blocks level (therefore from block to block, most superblock levels stay the same)
     
-    *** My implementation will simply be a list of block hashes, but it could be implemented as a merkle tree, just storing
-    the merkle root, however, for the demonstration of this, storage savings is not important. The index
-    of the list corresponds to the superchain level. (0 is block hash solution with at worst no extra zeros , 1 is super level 1, etc..)
+    *** My implementation behaves like a list of block hashes. The index of the list corresponds to the superchain
+    level. (0 is block hash solution with at worst no extra zeros , 1 is super level 1, etc..) The block header only
+    commits to the merkle root of the list, so a proof can carry just the root and the path of each level it uses
+    (see CommittedInterlink).
+
+    Consecutive levels usually point to the same block, and a new block only changes the levels up to the level of
+    the previous block. So the levels are stored as a linked list of runs (block hash, highest level of the run),
+    lowest levels first, and a new interlink adds one run in front of the runs of the previous block's interlink that
+    are above it. Those runs are shared, not copied, so each block costs one run whatever the number of levels.
+    The genesis block is kept as its hash and is always the last entry.
     """
+    __slots__ = ("genesis_hash", "runs", "_commitment")
+
     def __init__(self, genesis: blockchain_structs.Block):
-        self.genesis = genesis
-        self.interlink = [genesis.block_hash] # will make it so genesis is last block of interlink
+        self.genesis_hash = genesis.block_hash
+        self.runs = None # genesis is the only entry
+        self._commitment = None
+
+    @classmethod
+    def from_hashes(cls, hashes: List[str]):
+        """ Interlink of a block received in a proof, it can be checked but not updated"""
+        interlink = cls.__new__(cls)
+        interlink.genesis_hash = hashes[-1]
+        interlink.runs = None
+        interlink._commitment = None
+        # build the runs from the top, the first level seen of a run is its top
+        for level in range(len(hashes) - 2, -1, -1):
+            if interlink.runs is None or interlink.runs.block_hash != hashes[level]:
+                interlink.runs = _Run(hashes[level], level, interlink.runs)
+        return interlink
 
     def __str__(self):
         return str(self.interlink)
@@ -34,35 +58,146 @@ class Interlink:
     def __repr__(self):
         return str(self.interlink)
 
+    def __len__(self):
+        top = -1
+        run = self.runs
+        while run is not None:
+            top = run.top
+            run = run.above
+        return top + 2
+
+    def __iter__(self):
+        level = 0
+        run = self.runs
+        while run is not None:
+            while level <= run.top:
+                yield run.block_hash
+                level += 1
+            run = run.above
+        yield self.genesis_hash
+
+    def __getitem__(self, index):
+        return self.interlink[index]
+
+    def __contains__(self, block_hash) -> bool:
+        return self.contains(block_hash)
+
+    @property
+    def interlink(self) -> List[str]:
+        """ The levels as a list of block hashes, genesis last"""
+        return list(self)
+
+    def get_tree(self) -> merkle.OrderedMerkleTree:
+        # merkle tree over the interlink hashes, leaf i is superchain level i
+        tree = merkle.OrderedMerkleTree()
+        for block_hash in self:
+            tree.addNode(block_hash)
+        tree.initialize(verbose=False)
+        return tree
+
+    def get_commitment(self) -> bytes:
+        """ Returns the 20 byte merkle root of the interlink hashes, this is what goes in the block header"""
+        if self._commitment is None:
+            self._commitment = bytes.fromhex(self.get_tree().root)
+        return self._commitment
+
+    def contains(self, block_hash: str) -> bool:
+        run = self.runs
+        while run is not None:
+            if run.block_hash == block_hash:
+                return True
+            run = run.above
+        return block_hash == self.genesis_hash
+
+    def is_anchored(self, genesis_hash: str) -> bool:
+        # the genesis block is the last entry of every interlink
+        return self.genesis_hash == genesis_hash
+
+    def link_set(self) -> Set[str]:
+        # the distinct block hashes of all levels, for constant time link checks
+        links = {self.genesis_hash}
+        run = self.runs
+        while run is not None:
+            links.add(run.block_hash)
+            run = run.above
+        return links
+
     def update_interlink(self, last_block: blockchain_structs.Block, difficulty: int):
         """
         Update the interlink based on the previous blocks hash. Will be done each block creation.
-        Copies the last block's interlink.
+        Levels 0 to the level of the last block point to it, the levels above are shared with the last block's interlink.
         """
-        new_interlink = last_block.interlink.interlink.copy()
-        # - 1 to exclude the genesis block at end
-        num_levels = len(new_interlink) - 1 # number of superblock levels in interlink
         level = get_superblock_level(last_block, difficulty) # index of superblock
-        # print(f"Num_levels:{num_levels}\nlevel index:{level}") 
-        #(levels - 1) because we want the highest index not the length
-        if (num_levels - 1) < level:
-            new_interlink = new_interlink[:-1] # strip genesis
-            # create new super_level indices 
-            for i in range(level - (num_levels-1)):
-                new_interlink.append(0)
-            new_interlink.append(self.genesis.block_hash)
-        for i in range(level + 1):
-            new_interlink[i] = last_block.block_hash
-        self.interlink = new_interlink
-        # print(f"Block {last_block.height + 1} interlink: {self.interlink}")
+        above = last_block.interlink.runs
+        # skip the runs that are overwritten by the last block, a run partly covered keeps its upper part
+        while above is not None and above.top <= level:
+            above = above.above
+        self.genesis_hash = last_block.interlink.genesis_hash
+        self.runs = _Run(last_block.block_hash, level, above)
+        self._commitment = None
+
+class _Run:
+    """ Levels up to top (from the end of the run below) that point to block_hash, shared between interlinks"""
+    __slots__ = ("block_hash", "top", "above")
+
+    def __init__(self, block_hash: str, top: int, above):
+        self.block_hash = block_hash
+        self.top = top
+        self.above = above
+
+class CommittedInterlink:
+    """
+    Interlink of a block received in a proof when only its merkle root (the commitment in the block header)
+    is sent. It holds the root, the number of levels, {level: block hash} for the levels the proof relies on
+    and one merkle multi-proof for all of them. contains() only accepts hashes when the multi-proof leads to the root.
+    """
+    def __init__(self, root: str, size: int, links, hashes):
+        self.root = root
+        self.size = size
+        self.links = links
+        self.hashes = hashes
+        self.valid = None # whether the links lead to the root, checked on first use
+
+    def __repr__(self):
+        return f"<interlink root {self.root} with {self.size} levels>"
+
+    def get_commitment(self) -> bytes:
+        return bytes.fromhex(self.root)
+
+    def verify(self) -> bool:
+        if self.valid is None:
+            leaves = {level: merkle.hash_ordered_leaf(block_hash) for level, block_hash in self.links.items()}
+            self.valid = merkle.multiproof_root(self.size, leaves, self.hashes, merkle.hash_ordered_pair) == self.root
+        return self.valid
+
+    def contains(self, block_hash: str) -> bool:
+        return block_hash in self.links.values() and self.verify()
+
+    def is_anchored(self, genesis_hash: str) -> bool:
+        return self.links.get(self.size - 1) == genesis_hash and self.verify()
+
+    def link_set(self) -> Set[str]:
+        return set(self.links.values()) if self.verify() else set()
+
+def commit_interlink(interlink: Interlink, needed_hashes) -> CommittedInterlink:
+    """
+    Commits an interlink for a proof: keeps the root, the first level pointing to each hash in needed_hashes,
+    the genesis level, and a multi-proof of those levels.
+    """
+    tree = interlink.get_tree()
+    links = {}
+    for level, block_hash in enumerate(interlink.interlink):
+        if level == len(interlink.interlink) - 1 or (block_hash in needed_hashes and block_hash not in links.values()):
+            links[level] = block_hash
+    return CommittedInterlink(tree.root, len(interlink.interlink), links, tree.get_multiproof_hashes(links))
 
 def get_superblock_level(block: blockchain_structs.Block, difficulty: int):
-    """ returns the difference in trailing zeros
-    super block level = difference in # of trailing 0s"""
-    # format 0160b keeps trailing zeros up to 160 bits
-    block_hash = format(int(block.block_hash, 16), "0160b")
-    difficulty = format(difficulty, "0160b")
-    return (len(block_hash) - len(block_hash.lstrip('0'))) - (len(difficulty) - len(difficulty.lstrip('0')))
+    """ returns the difference in leading zeros of the block hash and the difficulty
+    super block level = difference in # of leading 0s
+    The level is computed once when the block is mined or added to the chain and stored in the block."""
+    if block.level is None:
+        block.set_level(difficulty)
+    return block.level
 
 def output_interlinks(chain: blockchain_structs.Blockchain):
     block_num = 0
@@ -74,33 +209,25 @@ def get_super_dist(chain: blockchain_structs.Blockchain, difficulty: int, k: int
     """
     Returns a dictionary representing the distribution of blocks at varying
     superblock levels. It discounts the last k blocks since the history of these
-    blocks remain to be solidified.
+    blocks remain to be solidified. Read from the level histogram the blockchain keeps.
     """
-    distribution_dict = {}
-    for block in chain.chain[:-k]:
-        level = get_superblock_level(block, difficulty)
-        if level in distribution_dict:
-            distribution_dict[level] += 1
-        else:
-            distribution_dict[level] = 1
-    return distribution_dict
+    return chain.get_level_counts(k)
 
-def find_block(chain: blockchain_structs.Blockchain, hash: str) -> blockchain_structs.Blockchain:
+def find_block(chain: blockchain_structs.Blockchain, hash: str) -> blockchain_structs.Block:
     """
-    I know this is not the most efficient way to do this. Indexing with a hashmap is O(1), but
-    we made it a list because it facilitated proof creation. 
+    Looks the block up in the blockchain's hash index (the chain itself stays a list ordered by
+    height because it facilitates proof creation). Returns False if no block has that hash.
     """
-    for block in chain.chain:
-        if block.block_hash == hash:
-            return block
-    return False
+    block = chain.get_block(hash)
+    if block is None:
+        return False
+    return block
 
 def find_txn_block(blockchain: blockchain_structs.Blockchain, txn_hash: str):
-    for block in blockchain.chain:
-        for txn in block.txs:
-            if txn.tx_id == txn_hash:
-                return block
-    return False
+    location = blockchain.find_tx(txn_hash)
+    if location is None:
+        return False
+    return location[0]
 
 def find_top_chain(blockchain: blockchain_structs.Blockchain, m: int, difficulty: int, k: int):
     """ Returns index of highest level superchain with at least m blocks"""
@@ -117,30 +244,21 @@ def find_top_chain(blockchain: blockchain_structs.Blockchain, m: int, difficulty
             top_chain = i
     return top_chain
 
-def get_superchain(blockchain: List[blockchain_structs.Block], sb_index: int, difficulty: int, k: int):
-    chain = []
+def get_superchain(blockchain: blockchain_structs.Blockchain, sb_index: int, difficulty: int, k: int, last: int = None):
     # -k is done to prevent adding any super blocks of the chain that are within the 
-    # untouched suffix
-    for block in blockchain[:-k]:
-        if get_superblock_level(block, difficulty) == sb_index:
-            chain.append(block)
-    return chain
+    # untouched suffix. With last, only the last that many blocks of the superchain are returned
+    return blockchain.get_superchain(sb_index, k, last)
 
-def get_extra_sblocks(blockchain: List[blockchain_structs.Block], m: int, k: int, difficulty: int):
+def get_extra_sblocks(blockchain: blockchain_structs.Blockchain, m: int, k: int, difficulty: int):
     """
     accumulates all blocks higher than the main superblock chain
     these are needed in order to make a valid chain for a proof
     """
-    blocks = []
-    extra_levels = []
     distribution = get_super_dist(blockchain, difficulty, k)
-    for key, value in distribution.items():
-        if (value < m) and (key > find_top_chain(blockchain, m, difficulty, k)):
-            extra_levels.append(key)
-    for block in blockchain.chain[:-k]:
-        if get_superblock_level(block, difficulty) in extra_levels:
-            blocks.append(block)
-    return blocks
+    top_chain = find_top_chain(blockchain, m, difficulty, k)
+    # the superchain above the top level holds each of these blocks once, already in height order
+    return [block for block in get_superchain(blockchain, top_chain + 1, difficulty, k)
+        if distribution[get_superblock_level(block, difficulty)] < m]
 
 def suffix_proof(blockchain: blockchain_structs.Blockchain, k: int, m: int, difficulty: int):
     """
@@ -159,13 +277,13 @@ def suffix_proof(blockchain: blockchain_structs.Blockchain, k: int, m: int, diff
     if isinstance(top_chain_index, str):
         print("ERROR", top_chain_index)
         return
-    chain = get_superchain(blockchain.chain, top_chain_index, difficulty, k)
+    chain = get_superchain(blockchain, top_chain_index, difficulty, k)
     prefix = []
     prefix.append(chain)
     # print("PREFIX SUPERCHAIN:", prefix)
     # now get last m blocks (or less than m blocks exist in that super chain) from each lower level. 
     for i in range(top_chain_index - 1, -1, -1):
-        sub_chain = get_superchain(blockchain.chain, i, difficulty, k)
+        sub_chain = get_superchain(blockchain, i, difficulty, k, m)
         if sub_chain is None:
             prefix.append([])
             # print(f"PREFIX LEVEL {i}:", sub_chain)
@@ -183,26 +301,64 @@ def suffix_proof(blockchain: blockchain_structs.Blockchain, k: int, m: int, diff
     prefix.append(suffix)
     return [prefix, get_extra_sblocks(blockchain, m, k, difficulty)]
 
-def infix_proof(blockchain: blockchain_structs.Blockchain, k: int, m: int, difficulty: int, txn_hash: str):
+def update_suffix_proof(blockchain: blockchain_structs.Blockchain, proof, k: int, m: int, difficulty: int):
+    """
+    Returns the suffix proof for the current chain given the suffix proof made before its last block
+    was added. The suffix window shifts by one block, and the block that leaves it is promoted into
+    the prefix: appended to the superchain of its level (keeping the last m blocks below the top level)
+    or to the extra superblocks. Returns None when the proof can't be shifted (the top superchain or the
+    set of extra levels changes), a new suffix_proof() is needed then.
+    """
+    prefix, extra = proof
+    top_chain_index = len(prefix) - 2 # prefix is [top superchain, levels top - 1 to 0, suffix]
+    settled_height = len(blockchain.chain) - k - 1
+    if k <= 0 or settled_height < 0 or find_top_chain(blockchain, m, difficulty, k) != top_chain_index:
+        return None
+    block = blockchain.get_block_at(settled_height)
+    level = get_superblock_level(block, difficulty)
+    new_prefix = [subchain.copy() for subchain in prefix[:-1]]
+    new_extra = extra
+    if level > top_chain_index:
+        if get_super_dist(blockchain, difficulty, k)[level] >= m:
+            return None
+        new_extra = extra + [block]
+    if level >= top_chain_index:
+        new_prefix[0].append(block)
+    # a block of level l is in the superchains of every level up to l
+    for i in range(min(level, top_chain_index - 1), -1, -1):
+        subchain = new_prefix[top_chain_index - i]
+        subchain.append(block)
+        if m and len(subchain) > m:
+            del subchain[0]
+    new_prefix.append(blockchain.chain[-k:])
+    return [new_prefix, new_extra]
+
+def copy_suffix_proof(proof):
+    # the proof functions and verifiers append to the lists of a proof, copy one before reusing it
+    return [[subchain.copy() for subchain in proof[0]], proof[1].copy()]
+
+def infix_proof(blockchain: blockchain_structs.Blockchain, k: int, m: int, difficulty: int, txn_hash: str, suffix = None):
+    """
+    suffix can be a suffix proof already made for the current chain with the same k and m, it is used
+    as the scaffolding instead of making a new one.
+    """
     # find block with transaction
     predicate_block = find_txn_block(blockchain, txn_hash)
     # print(f"txn found in block {predicate_block.height}")
     if predicate_block:
         # print("BLOCK FOUND:", predicate_block)
         # find suffix proof which gives the scaffolding for the proof 
-        proof_blocks = suffix_proof(blockchain, k, m, difficulty)
+        if suffix is None:
+            proof_blocks = suffix_proof(blockchain, k, m, difficulty)
+        else:
+            proof_blocks = copy_suffix_proof(suffix)
         chain = proof_blocks[0].copy()
         if proof_blocks[1]:
             chain.append(proof_blocks[1])
         chain = chain_from_proof(chain)
         # print("PRE FOLLOW DOWN:", [block.height for block in chain])
         if predicate_block not in chain:
-            index = 0
-            for block in chain:
-                if block.height > predicate_block.height:
-                    chain = follow_down(blockchain, chain, predicate_block, block.height)
-                    break
-                index += 1
+            chain = connect_predicate(blockchain, chain, predicate_block)
             # print("INFIX CHAIN:",chain)
         proof_blocks.append(chain)
         return proof_blocks
@@ -210,22 +366,69 @@ def infix_proof(blockchain: blockchain_structs.Blockchain, k: int, m: int, diffi
         print(f"No block in chain contains transaction with hash {txn_hash}")
         return False
 
+def batch_infix_proof(blockchain: blockchain_structs.Blockchain, k: int, m: int, difficulty: int, txn_hashes: List[str], suffix = None):
+    """
+    Infix proof for many transactions at once: [prefix, suffix, blocks, predicates]. The suffix scaffolding is made
+    once and the follow_down paths of all the predicate blocks are merged into one deduplicated set of blocks.
+    predicates holds one list per txn hash, [block holding it] or [] when no block does.
+    """
+    if suffix is None:
+        proof_blocks = suffix_proof(blockchain, k, m, difficulty)
+    else:
+        proof_blocks = copy_suffix_proof(suffix)
+    chain = proof_blocks[0].copy()
+    if proof_blocks[1]:
+        chain.append(proof_blocks[1])
+    chain = chain_from_proof(chain)
+    in_chain = set(block.block_hash for block in chain)
+    predicates = []
+    for txn_hash in txn_hashes:
+        predicate_block = find_txn_block(blockchain, txn_hash)
+        if not predicate_block:
+            print(f"No block in chain contains transaction with hash {txn_hash}")
+            predicates.append([])
+            continue
+        predicates.append([predicate_block])
+        if predicate_block.block_hash not in in_chain:
+            chain = connect_predicate(blockchain, chain, predicate_block)
+            in_chain.update(block.block_hash for block in chain)
+    proof_blocks.append(chain)
+    proof_blocks.append(predicates)
+    return proof_blocks
+
+def connect_predicate(blockchain: blockchain_structs.Blockchain, chain: List[blockchain_structs.Block], predicate_block: blockchain_structs.Block):
+    """
+    Follows down from the lowest block of chain (sorted by height, descending) above predicate_block to it. No
+    block of the chain lies between the two, so the blocks added keep every block of the chain linked to the next.
+    """
+    above = None
+    for block in chain:
+        if block.height <= predicate_block.height:
+            break
+        above = block
+    if above is None:
+        return chain
+    return follow_down(blockchain, chain, predicate_block, above.height)
+
 def follow_down(blockchain: blockchain_structs.Blockchain, proof_blocks: List[blockchain_structs.Block], predicate_block: blockchain_structs.Block, index: int):
     """
     Algorithm that produces the necessary blocks to connect a superblock to a preceeding block of interest.
+    index is the height of the block to start from.
     """
+    in_proof = set(block.block_hash for block in proof_blocks)
     while True:
-        if predicate_block.block_hash in blockchain.chain[index].interlink.interlink:
+        interlink = blockchain.get_block_at(index).interlink.interlink
+        if predicate_block.block_hash in interlink:
             break
         else:
             # find the highest next block in the interlink structure such that 
             # the block to be added doesn't go past the predicate_block
-            interlink = blockchain.chain[index].interlink.interlink
             for i in range(len(interlink) - 1, -1, -1):
                 block = find_block(blockchain, interlink[i])
                 if block.height > predicate_block.height:
-                    if block not in proof_blocks:
+                    if block.block_hash not in in_proof:
                         proof_blocks.append(block)
+                        in_proof.add(block.block_hash)
                         # print("BLOCK ADDED:", block)
                     index = block.height
                     break
@@ -234,7 +437,7 @@ def follow_down(blockchain: blockchain_structs.Blockchain, proof_blocks: List[bl
     # print("FINAL CHAIN:",[block.height for block in proof_blocks])
     return proof_blocks
 
-def verify_suffix(proof_blocks: List[blockchain_structs.Block], stored_superchain, k: int, genesis: blockchain_structs.Block, superchain: List[blockchain_structs.Block]):
+def verify_suffix(proof_blocks: List[blockchain_structs.Block], stored_superchain, k: int, genesis: blockchain_structs.Block):
     """
     Checks:
         1) Valid chain such that genesis is the same and the suffix connects to the prefix.
@@ -250,7 +453,7 @@ def verify_suffix(proof_blocks: List[blockchain_structs.Block], stored_superchai
         return False
     # the first element of the list is the desired superchain
     # checks to see if their stored superchain is apart of the proof
-    if proof[0] != stored_superchain:
+    if [block.block_hash for block in proof[0]] != [block.block_hash for block in stored_superchain]:
         print("Verification Error: Discrepcancy between stored superchain and proof")
         print(f"Stored Superchain:{stored_superchain}")
         print(f"Proof top superchain:{proof[0]}")
@@ -258,34 +461,58 @@ def verify_suffix(proof_blocks: List[blockchain_structs.Block], stored_superchai
     
     chain = proof_blocks[0]
     if proof_blocks[1]:
-        chain.append(proof_blocks[1])
+        chain = chain + [proof_blocks[1]]
     chain = chain_from_proof(chain)
-    return validate_chain(chain, genesis, superchain)
+    return validate_chain(chain, genesis)
 
-def validate_chain(chain: List[blockchain_structs.Block], genesis: blockchain_structs.Block, superchain: List[blockchain_structs.Block]):
-    if chain[-1] != genesis:
-        chain.append(genesis)
+def validate_chain(chain: List[blockchain_structs.Block], genesis: blockchain_structs.Block):
+    """
+    Checks each block of chain (sorted by height, descending) links to the next one, and that every block is anchored
+    to genesis. Proofs are built from superchains holding every block of their level or higher, so consecutive blocks
+    of an honest proof are always linked. Each interlink is turned into a set of hashes once, so each check takes
+    constant time and the chain is validated in time linear in its size.
+    """
+    if chain[-1].block_hash != genesis.block_hash:
+        chain = chain + [genesis]
     # print("VALIDATING CHAIN:", [block.height for block in chain])
-    for i in range(len(chain)):
+    for i in range(len(chain) - 1):
         # if at end of the list
-        if chain[i+1] == genesis:
+        if chain[i+1].block_hash == genesis.block_hash:
             break
         # the next block in the list must be connected on some level within a given blocks interlink
-        interlink_connection = chain[i+1].block_hash not in chain[i].interlink.interlink
-        superchain_connection = True
-        for i in range(len(superchain)):
-            if superchain[i].block_hash in chain[i+1].interlink.interlink:
-                superchain_connection = False
-        if interlink_connection and superchain_connection:
+        links = chain[i].interlink.link_set() if chain[i].interlink is not None else set()
+        interlink_connection = chain[i+1].block_hash in links
+        if not interlink_connection:
             print(f"Verification Error: Not a valid chain! interlink of block {chain[i]} has no record of block {chain[i+1]}")
-            print(f"{chain[i]} interlink: {chain[i].interlink.interlink}")
+            print(f"{chain[i]} interlink: {chain[i].interlink}")
             return False
         # if the blocks have a different genesis block
-        if chain[i].interlink.interlink[-1] != genesis.block_hash:
+        if not chain[i].interlink.is_anchored(genesis.block_hash):
             print(f"Verification Error: Block with hash {chain[i]} is not chained to genesis")
             return False
     return True
 
+def _is_blocks(items) -> bool:
+    return isinstance(items, list) and not any(isinstance(item, list) for item in items)
+
+def valid_layout(proof, parts: int) -> bool:
+    """
+    Whether proof has the layout of a suffix (2 parts), infix (3) or batch infix proof (4): [prefix, extra superblocks,
+    infix chain, predicates], with the prefix a non-empty list of block lists (the superchains, suffix last), the
+    extra superblocks a list of blocks, the infix chain a non-empty list of blocks and the predicates a list of lists
+    of at most one block. The verifiers check it before reading a proof they were sent.
+    """
+    if not isinstance(proof, list) or len(proof) != parts:
+        return False
+    prefix, extra = proof[0], proof[1]
+    if not isinstance(prefix, list) or not prefix or not all(_is_blocks(subchain) for subchain in prefix) or not _is_blocks(extra):
+        return False
+    if parts > 2 and (not _is_blocks(proof[2]) or not proof[2]):
+        return False
+    if parts > 3 and not (isinstance(proof[3], list) and all(_is_blocks(predicate) and len(predicate) <= 1 for predicate in proof[3])):
+        return False
+    return True
+
 def chain_from_proof(proof: List[List[blockchain_structs.Block]]) -> List[blockchain_structs.Block]:
     """
     This function correctly orders the blocks of the prefix and suffix of a suffix proof based on block height
@@ -296,8 +523,8 @@ def chain_from_proof(proof: List[List[blockchain_structs.Block]]) -> List[blockc
     
     Returns a list of the blocks in the prefix and suffix sorted by block height in descending order
     """
-    ordered_chain = [block for subchain in proof for block in subchain]
-    ordered_chain = list(set(ordered_chain)) # remove any duplicates
+    # remove any duplicates, a block can appear on several levels
+    ordered_chain = list({block.block_hash: block for subchain in proof for block in subchain}.values())
     ordered_chain.sort(key=lambda x: x.height, reverse=True)
     # print([block.height for block in ordered_chain])
     return ordered_chain
@@ -319,24 +546,50 @@ def verify_infix(proof: List[List[blockchain_structs.Block]], stored_superchain,
     """
     # if len(proof[:-1][-1] != k:
     #     suffix_modifier = -2
-    if verify_suffix(proof[:-1], stored_superchain, k, genesis, stored_superchain):
+    if not valid_layout(proof, 3):
+        print("Verification Error: Not an infix proof")
+        return False
+    if verify_suffix(proof[:-1], stored_superchain, k, genesis):
         # print("Valid suffix proof")
         # print("PREFIX CHAIN: ", proof[:-1][:-1])
         # print("SUFFIX CHAIN: ", proof[:-1][-1])
         # print("Verifying infix proof")
         print("Proof length",len(proof))
-        if validate_chain(proof[-1], genesis, stored_superchain):
+        if validate_chain(proof[-1], genesis):
             print(f"Transaction with hash {txn_hash} exists in the chain")
             print("NiPoPow Proof Information")
             print("==========================")
-            print("PREFIX CHAIN: ", proof[0][:-2])
-            print(f"SUFFIX CHAIN: {proof[0][-2]} of k = {k} blocks")
+            print("PREFIX CHAIN: ", proof[0][:-1])
+            print(f"SUFFIX CHAIN: {proof[0][-1]} of k = {k} blocks")
             print("FINAL BLOCK SET PROOF:", [block.height for block in proof[-1]])
             return True
         else:
             print("Verification Error: Invalid infix proof")
     return False
 
+def verify_batch_infix(proof: List[List[blockchain_structs.Block]], stored_superchain, k: int, genesis: blockchain_structs.Block, txn_hashes: List[str]) -> Dict[str, bool]:
+    """
+    Verifies a batch_infix_proof in one pass: the suffix and the merged infix chain are validated once, then each
+    transaction is accepted if its predicate block is part of that chain. Returns {txn hash: bool}.
+    """
+    results = {txn_hash: False for txn_hash in txn_hashes}
+    if not valid_layout(proof, 4):
+        print("Verification Error: Not a batch infix proof")
+        return results
+    predicates = proof[-1]
+    if len(predicates) != len(txn_hashes):
+        print("Verification Error: Batch proof does not match the transactions asked for")
+        return results
+    if not verify_suffix(proof[:2], stored_superchain, k, genesis) or not validate_chain(proof[2], genesis):
+        print("Verification Error: Invalid batch infix proof")
+        return results
+    in_chain = set(block.block_hash for block in proof[2])
+    for txn_hash, predicate in zip(txn_hashes, predicates):
+        results[txn_hash] = len(predicate) == 1 and predicate[0].block_hash in in_chain
+    print(f"{sum(results.values())} of {len(txn_hashes)} transactions exist in the chain")
+    print("FINAL BLOCK SET PROOF:", [block.height for block in proof[2]])
+    return results
+
 def output_blockhashes(blockchain, difficulty):
     for block in blockchain.chain:
         print(f"Block {block.height}: {block.block_hash} || Level {get_superblock_level(block, difficulty)}")
@@ -350,7 +603,7 @@ if __name__ == "__main__":
     txn_hash = chain.chain[20].txs[0].tx_id
     output_blockhashes(chain, difficulty)
     # output_interlinks(chain)
-    stored_chain = get_superchain(chain.chain, find_top_chain(chain, m, difficulty, k), difficulty, k)
+    stored_chain = get_superchain(chain, find_top_chain(chain, m, difficulty, k), difficulty, k)
     print("Super Block Distribution:", get_super_dist(chain, difficulty, k))
     proof = infix_proof(chain, k, m, difficulty, txn_hash)
     print("FINAL INFIX PROOF",proof)
@@ -1,4 +1,7 @@
+import sys
 import nipopow
+import proof_codec
+import blockstore
 from miner import generate_blockchain
 from fullnode import FullNode
 
@@ -20,23 +23,47 @@ class NiPoPow_Client:
         self.genesis = genesis
     
     def verify_transaction(self, txn: str):
-        proof = self.fullnode.get_nipopow_proof(self.k, self.m, txn)
-        if not proof:
+        data = self.fullnode.get_encoded_nipopow_proof(self.k, self.m, txn)
+        if not data:
             return False
-        nipopow.verify_infix(proof, self.superchain, self.k, self.genesis, txn)
+        print(f"Received proof of {len(data)} bytes")
+        try:
+            proof = proof_codec.decode_proof(data)
+        except ValueError as e:
+            print("Verification Error:", e)
+            return False
+        return nipopow.verify_infix(proof, self.superchain, self.k, self.genesis, txn)
+
+    def verify_transactions(self, txns):
+        # Verifies many transactions with one batched proof, returns {txn: bool}
+        data = self.fullnode.get_encoded_batch_nipopow_proof(self.k, self.m, txns)
+        print(f"Received proof of {len(data)} bytes for {len(txns)} transactions")
+        try:
+            proof = proof_codec.decode_proof(data)
+        except ValueError as e:
+            print("Verification Error:", e)
+            return {txn: False for txn in txns}
+        return nipopow.verify_batch_infix(proof, self.superchain, self.k, self.genesis, txns)
 
 if __name__ == '__main__':
     """ Simple Test implementation of the System"""
     print("\n---------------------------------------------------------------------")
     print("Non Interactive Proof of Proof of Work Client Simulation")
     print("---------------------------------------------------------------------\n")
-    blocklen=input("How many blocks would you like the blockchain to contain:\n$\t")
-    difficulty = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF
-    try:
-        chain = generate_blockchain(int(blocklen.strip()), 25, difficulty)
-    except:
-        print("Could not read block number... generating chain of 25 blocks")
-        chain = generate_blockchain(25, 25, difficulty)
+    # python3 nipopow_client.py [block store path], the chain is reloaded from the store or mined and written to it
+    store_path = sys.argv[1] if len(sys.argv) > 1 else None
+    chain = blockstore.load_blockchain(store_path) if store_path else None
+    if chain is None:
+        blocklen=input("How many blocks would you like the blockchain to contain:\n$\t")
+        difficulty = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF
+        store = blockstore.BlockStore(store_path, 25, difficulty) if store_path else None
+        try:
+            blocklen = int(blocklen.strip())
+        except ValueError:
+            print("Could not read block number... generating chain of 25 blocks")
+            blocklen = 25
+        chain = generate_blockchain(blocklen, 25, difficulty, store=store)
+    difficulty = chain.difficulty
     fn = FullNode(chain)
     fn.set_difficulty(difficulty)
     wallet = NiPoPow_Client(fn)
@@ -59,6 +86,8 @@ if __name__ == '__main__':
             fn.store_blockchain_transactions("blockchain.txt")
         elif x == "HEADER" or x == "HEADERS" or x == "HEAD":
             wallet.print_superchain()
+        elif x.startswith("BATCH ") or x.startswith("b "):
+            wallet.verify_transactions(x.split()[1:])
         elif x == "HELP" or x == "h":
             print("---------------------------------------------------------------------")
             print("\t\tNiPoPow Verification Simulation\n")
@@ -75,6 +104,7 @@ if __name__ == '__main__':
             print("\n\t'QUIT'/'q':\n\t\t- Closes the program")
             print("\n\t'STORE'/'s':\n\t\t-Store the blockchain in a file titled 'blockchain.txt\n'")
             print("\n\t'HEADER'/'head':\n\t\t- Prints stored headers within the NiPoPow Client")
+            print("\n\t'BATCH'/'b' <tx ids>:\n\t\t- Verifies several transactions with one proof")
             print("---------------------------------------------------------------------\n")
         else:
             wallet.verify_transaction(x.strip())
\ No newline at end of file
@@ -0,0 +1,202 @@
+"""
+Compact binary wire format for NiPoPoW proofs.
+
+suffix_proof/infix_proof return nested lists of full Block objects, which carry their txs, the whole
+prev_block chain and an interlink holding the genesis block. A proof only needs the headers, so the
+encoding is a table of the distinct headers (each block once, however many levels it appears in)
+followed by the nesting of the proof as indices into that table:
+
+    magic "NPP" | version u8 | mode u8 | block count u32 | headers | proof structure
+
+    header:    height u32 | block hash 20 | prev hash 20 | merkle root length u8 | merkle root
+               | timestamp u64 | nonce u64 | interlink length u8 | interlink hashes 20 each
+    structure: LIST u8 | item count u32 | items    or    BLOCK u8 | header index u32
+
+In committed mode (the default) a header can carry its interlink merkle root (the commitment hashed into
+the block header) instead of the interlink hashes, followed by the levels the proof relies on:
+
+    committed interlink: interlink length u8 | FULL u8 | interlink hashes 20 each
+                     or  interlink length u8 | COMMITTED u8 | root 20 | link count u8 | links | hash count u8 | hashes 20 each
+    link:                level u8 | block hash 20
+
+A level is included when it is the first to point to another block of the proof, or the genesis level.
+The hashes are one merkle multi-proof for all included levels (see merkle.multiproof_root and
+OrderedMerkleTree). On short chains an interlink has few levels and the root, links and multi-proof
+take more room than the list itself, so each interlink is sent whichever way is smaller, and when
+that byte per header still makes the proof larger than in full mode the full encoding is sent instead.
+
+decode_proof() gives back the same nesting with BlockHeader objects, which verify_infix can check
+against the blocks the light client stored.
+"""
+import struct
+from typing import *
+import blockchain_structs as bs
+import nipopow
+
+MAGIC = b"NPP"
+VERSION = 2
+FULL, COMMITTED = 0, 1 # how interlinks are encoded
+_PREAMBLE = struct.Struct(">3sBBI")
+_HEADER_START = struct.Struct(">I20s20sB")
+_HEADER_END = struct.Struct(">QQB")
+_LINK = struct.Struct(">B20s")
+_NODE = struct.Struct(">BI")
+_LIST, _BLOCK = 0, 1
+_MAX_DEPTH = 8 # proofs nest a few lists deep, a deeper structure is not a proof
+
+def _collect_blocks(proof, blocks: dict):
+    # block hash -> (index, block) in order of first appearance
+    for item in proof:
+        if isinstance(item, list):
+            _collect_blocks(item, blocks)
+        elif item.block_hash not in blocks:
+            blocks[item.block_hash] = (len(blocks), item)
+
+def _encode_header(block, mode: int, proof_hashes) -> bytes:
+    prev_hash = block.prev_block.block_hash if block.prev_block is not None else None
+    merkle_root = bs.digest_to_bytes(block.merkle_root, 32)
+    interlink = block.interlink.interlink if block.interlink is not None else []
+    out = [
+        _HEADER_START.pack(block.height, bs.digest_to_bytes(block.block_hash), bs.digest_to_bytes(prev_hash), len(merkle_root)),
+        merkle_root,
+        _HEADER_END.pack(block.timestamp, block.nonce, len(interlink))
+    ]
+    if not interlink:
+        return b"".join(out)
+    committed = nipopow.commit_interlink(block.interlink, proof_hashes) if mode == COMMITTED else None
+    if committed is None or 22 + _LINK.size * len(committed.links) + 20 * len(committed.hashes) >= 20 * len(interlink):
+        if mode == COMMITTED:
+            out.append(bytes([FULL]))
+        out += [bs.digest_to_bytes(link) for link in interlink]
+    else:
+        out.append(bytes([COMMITTED]) + bytes.fromhex(committed.root) + bytes([len(committed.links)]))
+        out += [_LINK.pack(level, bs.digest_to_bytes(link)) for level, link in committed.links.items()]
+        out.append(bytes([len(committed.hashes)]))
+        out += [bytes.fromhex(sibling) for sibling in committed.hashes]
+    return b"".join(out)
+
+def _encode_structure(proof, blocks: dict, out: List[bytes]):
+    out.append(_NODE.pack(_LIST, len(proof)))
+    for item in proof:
+        if isinstance(item, list):
+            _encode_structure(item, blocks, out)
+        else:
+            out.append(_NODE.pack(_BLOCK, blocks[item.block_hash][0]))
+
+def _encode(proof, blocks: dict, mode: int) -> bytes:
+    out = [_PREAMBLE.pack(MAGIC, VERSION, mode, len(blocks))]
+    out += [_encode_header(block, mode, blocks) for _, block in blocks.values()]
+    _encode_structure(proof, blocks, out)
+    return b"".join(out)
+
+def encode_proof(proof, mode: int = COMMITTED) -> bytes:
+    """
+    Encodes a suffix or infix proof (nested lists of blocks) to bytes, with full or committed interlinks.
+    Committed mode never gives more bytes than full mode, it falls back to it when that is smaller.
+    """
+    blocks = {}
+    _collect_blocks(proof, blocks)
+    full = _encode(proof, blocks, FULL)
+    if mode == FULL:
+        return full
+    return min(_encode(proof, blocks, COMMITTED), full, key=len)
+
+def proof_size(proof, mode: int = COMMITTED) -> int:
+    """ Size in bytes of the encoded proof"""
+    return len(encode_proof(proof, mode))
+
+def _need(data: bytes, offset: int, size: int):
+    # the decoders check the data holds what they read next instead of letting slicing come up short
+    if offset + size > len(data):
+        raise ValueError("Truncated NiPoPoW proof")
+
+def _read_hashes(data: bytes, offset: int, count: int):
+    _need(data, offset, 20 * count)
+    return [data[i:i + 20].hex() for i in range(offset, offset + 20 * count, 20)], offset + 20 * count
+
+def _decode_interlink(data: bytes, offset: int, mode: int, size: int):
+    if size == 0:
+        return None, offset
+    if mode == COMMITTED:
+        _need(data, offset, 1)
+        mode = data[offset]
+        offset += 1
+    if mode == FULL:
+        hashes, offset = _read_hashes(data, offset, size)
+        return nipopow.Interlink.from_hashes(hashes), offset
+    if mode != COMMITTED:
+        raise ValueError(f"Unknown interlink encoding {mode}")
+    _need(data, offset, 21)
+    root = data[offset:offset + 20].hex()
+    link_count = data[offset + 20]
+    offset += 21
+    _need(data, offset, link_count * _LINK.size + 1)
+    links = {}
+    for _ in range(link_count):
+        level, link = _LINK.unpack_from(data, offset)
+        if level >= size:
+            raise ValueError(f"Interlink level {level} is past its {size} levels")
+        links[level] = link.hex()
+        offset += _LINK.size
+    hashes, offset = _read_hashes(data, offset + 1, data[offset])
+    return nipopow.CommittedInterlink(root, size, links, hashes), offset
+
+def _decode_header(data: bytes, offset: int, mode: int):
+    _need(data, offset, _HEADER_START.size)
+    height, block_hash, prev_hash, merkle_length = _HEADER_START.unpack_from(data, offset)
+    offset += _HEADER_START.size
+    if merkle_length > 32:
+        raise ValueError(f"Merkle root of block {height} is longer than 32 bytes")
+    _need(data, offset, merkle_length + _HEADER_END.size)
+    merkle_root = data[offset:offset + merkle_length]
+    offset += merkle_length
+    timestamp, nonce, interlink_length = _HEADER_END.unpack_from(data, offset)
+    interlink, offset = _decode_interlink(data, offset + _HEADER_END.size, mode, interlink_length)
+    header = bs.BlockHeader(block_hash.hex(), height, prev_hash.hex() if any(prev_hash) else None,
+        merkle_root.hex(), timestamp, nonce, interlink)
+    if header.compute_hash() != header.block_hash:
+        raise ValueError(f"Header of block {height} does not hash to {header.block_hash}")
+    return header, offset
+
+def _decode_structure(data: bytes, offset: int, headers: list, depth: int = 0):
+    _need(data, offset, _NODE.size)
+    kind, value = _NODE.unpack_from(data, offset)
+    offset += _NODE.size
+    if kind == _BLOCK:
+        if value >= len(headers):
+            raise ValueError(f"Proof refers to header {value} of {len(headers)}")
+        return headers[value], offset
+    if kind != _LIST or depth >= _MAX_DEPTH:
+        raise ValueError("Malformed NiPoPoW proof structure")
+    items = []
+    for _ in range(value):
+        item, offset = _decode_structure(data, offset, headers, depth + 1)
+        items.append(item)
+    return items, offset
+
+def decode_proof(data: bytes):
+    """
+    Decodes bytes from encode_proof back into nested lists of BlockHeader objects. Raises ValueError
+    if the data is not an encoded proof (truncated, corrupted or with bytes left over), its nesting is not
+    that of a suffix, infix or batch proof (see nipopow.valid_layout) or a header does not hash to its block hash.
+    """
+    if len(data) < _PREAMBLE.size:
+        raise ValueError("Not an encoded NiPoPoW proof")
+    magic, version, mode, count = _PREAMBLE.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION or mode not in (FULL, COMMITTED):
+        raise ValueError("Not an encoded NiPoPoW proof")
+    offset = _PREAMBLE.size
+    headers = []
+    try:
+        for _ in range(count):
+            header, offset = _decode_header(data, offset, mode)
+            headers.append(header)
+        proof, offset = _decode_structure(data, offset, headers)
+    except (struct.error, IndexError) as e:
+        # the checks above should leave nothing for these, but a bad proof must only ever be a ValueError
+        raise ValueError(f"Malformed NiPoPoW proof: {e}") from e
+    if offset != len(data):
+        raise ValueError("Bytes left over after the NiPoPoW proof")
+    if not any(nipopow.valid_layout(proof, parts) for parts in (2, 3, 4)):
+        raise ValueError("Decoded data is not laid out as a suffix, infix or batch proof")
+    return proof
@@ -10,12 +10,22 @@ it will hold an instance of the full node that it communicates with.
 """
 from miner import *
 from hashlib import sha1
+import sys
+import blockstore
+import headerstore
 from fullnode import *
+import merkle
 
 class SPV:
     def __init__(self, fullnode, blockheaders):
         self.fullnode = fullnode  # instance of fullnode object
-        self.headers = blockheaders # all headers in the blockchain
+        self.headers = blockheaders # all headers in the blockchain, a list of header dicts or a headerstore.HeaderStore
+
+    def sync_headers(self):
+        """ Appends the headers of the full node's new blocks to a HeaderStore, returns how many were added"""
+        added = self.headers.sync(self.fullnode.blockchain)
+        print("\n|SPV Wallet|\n\tSynced {n} new headers, {t} stored".format(n=added, t=len(self.headers)))
+        return added
 
     def verify_transaction(self, tid):
         """
@@ -49,21 +59,61 @@ class SPV:
         else:
             print("\tPath lead to incorrect root value:\n\tGiven: "+ str(hashed) + ", Actual: " + str(self.headers[fullnodeinfo["blockid"]]["merkle"]))
 
+    def verify_transactions(self, tids):
+        """
+        Verifies many transactions with one merkle multi-proof per block. Each multi-proof holds every
+        sibling hash needed by the transactions of that block once, and the root is computed in a single
+        pass. Returns a dictionary tid -> True/False.
+        """
+        verified = {tid: False for tid in tids}
+        proofs = self.fullnode.get_multipath(tids)
+        print("\n|SPV Wallet|")
+        for proof in proofs:
+            # only the tids asked about are used, each must have a leaf of its own in the tree
+            indices = {tid: index for tid, index in proof["indices"].items() if tid in verified}
+            leaves = {index: merkle.hash_leaf(tid) for tid, index in indices.items()}
+            root = None
+            if len(leaves) == len(indices) and 0 <= proof["blockid"] < len(self.headers):
+                root = merkle.multiproof_root(proof["leaf_count"], leaves, proof["hashes"])
+            if root is not None and self.headers[proof["blockid"]]["merkle"] == root:
+                for tid in indices:
+                    verified[tid] = True
+                print("\t{n} transactions verified in block {b}".format(n=len(indices), b=proof["blockid"]))
+            else:
+                print("\tMulti-proof for block {b} lead to incorrect root value".format(b=proof["blockid"]))
+        for tid, valid in verified.items():
+            if not valid:
+                print("\tCould not verify Transaction "+ str(tid))
+        return verified
+
 
-def simulation():
-    """ The System to be run when user runs SPV.py"""
+def simulation(store_path = None):
+    """
+    The System to be run when user runs SPV.py
+    With store_path the chain is reloaded from that block store, or mined and written to it if there is none yet.
+    """
     print("\n---------------------------------------------------------------------")
     print("Simple Payment Verification Simulation")
     print("---------------------------------------------------------------------\n")
-    blocklen=input("How many blocks would you like the blockchain to contain:\n (for efficient speeds, stick to height of 10-30)\n$\t")
-    coinbase=input("What would you like the coinbase to be:\n$\t")
-    try:
-        chain = generate_blockchain(int(blocklen.strip()), int(coinbase.strip()), 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF)
-    except:
-        print("Could Not Read transaction")
-        chain = generate_blockchain(8, 25, 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF)
+    chain = blockstore.load_blockchain(store_path) if store_path else None
+    if chain is None:
+        blocklen=input("How many blocks would you like the blockchain to contain:\n (for efficient speeds, stick to height of 10-30)\n$\t")
+        coinbase=input("What would you like the coinbase to be:\n$\t")
+        try:
+            blocklen, coinbase = int(blocklen.strip()), int(coinbase.strip())
+        except:
+            print("Could Not Read transaction")
+            blocklen, coinbase = 8, 25
+        difficulty = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF
+        store = blockstore.BlockStore(store_path, coinbase, difficulty) if store_path else None
+        chain = generate_blockchain(blocklen, coinbase, difficulty, store=store)
     fn = FullNode(chain)
-    wallet = SPV(fn, chain.headers)
+    if store_path:
+        # the wallet keeps its own headers next to the node's block store and only syncs the new ones
+        wallet = SPV(fn, headerstore.HeaderStore(store_path + ".headers"))
+        wallet.sync_headers()
+    else:
+        wallet = SPV(fn, chain.headers)
     valid_transaction = chain.head.prev_block.txs[2].tx_id
     print("---------------------------------------------------------------------")
     print("Blockchain Generated,")
@@ -98,4 +148,5 @@ def simulation():
 
 
 if __name__ == "__main__":
-    simulation()
+    # python3 spv.py [block store path]
+    simulation(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,99 @@
+import os
+import sys
+import unittest
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+import miner
+import blockchain_structs as bs
+import nipopow
+
+"""
+This file tests the indexes the Blockchain keeps up to date in add_block.
+
+Run: python -m unittest tests/test_blockchain.py
+"""
+
+class TestBlockchainIndexes(unittest.TestCase):
+    difficulty = 0x7FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF
+    chain = miner.generate_blockchain(10, 25, difficulty)
+
+    def test_tx_index(self):
+        for block in self.chain.chain:
+            for position, tx in enumerate(block.txs):
+                self.assertEqual(self.chain.find_tx(tx.tx_id), (block, position))
+        self.assertIsNone(self.chain.find_tx("not a tx"))
+
+    def test_block_indexes(self):
+        for height, block in enumerate(self.chain.chain):
+            self.assertIs(self.chain.get_block(block.block_hash), block)
+            self.assertIs(self.chain.get_block_at(height), block)
+        self.assertIsNone(self.chain.get_block("not a block"))
+
+    def test_stored_superblock_level(self):
+        for block in self.chain.chain:
+            # leading zeros of the hash beyond the ones the difficulty requires
+            expected = (160 - int(block.block_hash, 16).bit_length()) - (160 - self.difficulty.bit_length())
+            self.assertEqual(block.level, expected)
+            self.assertEqual(bs.superblock_level(block.block_hash, self.chain.difficulty_bits), expected)
+
+    def test_superchain_index(self):
+        for k in (1, 3, 20):
+            settled = self.chain.chain[:-k]
+            counts = {}
+            for block in settled:
+                counts[block.level] = counts.get(block.level, 0) + 1
+            self.assertEqual(self.chain.get_level_counts(k), counts)
+            for level in counts:
+                superchain = [block for block in settled if block.level >= level]
+                self.assertEqual(self.chain.get_superchain(level, k), superchain)
+                self.assertEqual(self.chain.get_superchain(level, k, last=2), superchain[-2:])
+
+    def test_interlinks(self):
+        genesis = self.chain.chain[0].block_hash
+        expected = [genesis]
+        for prev, block in zip(self.chain.chain[1:], self.chain.chain[2:]):
+            # levels up to the previous block's level point to it, genesis stays last
+            expected = expected[:-1] + [None] * max(0, prev.level + 2 - len(expected)) + [genesis]
+            expected[:prev.level + 1] = [prev.block_hash] * (prev.level + 1)
+            self.assertEqual(block.interlink.interlink, expected)
+            self.assertEqual(len(block.interlink), len(expected))
+            self.assertEqual(nipopow.Interlink.from_hashes(expected).interlink, expected)
+            # the levels above the previous block's level are shared with its interlink
+            above = block.interlink.runs.above
+            self.assertTrue(above is None or any(above is run for run in iter_runs(prev.interlink)))
+
+    def test_utxo_set(self):
+        spent = {utxo.id for block in self.chain.chain for tx in block.txs for utxo in tx.vin}
+        unspent = {utxo.id: utxo for block in self.chain.chain for tx in block.txs for utxo in tx.vout
+            if utxo.id not in spent}
+        self.assertEqual(self.chain.utxos.outputs, unspent)
+        for pub_key in [miner.MINER[1]] + [address[1] for address in miner.ADDRESSES]:
+            owned = [utxo for utxo in unspent.values() if utxo.pub_key == pub_key]
+            self.assertCountEqual(self.chain.utxos.unspent(pub_key), owned)
+            self.assertEqual(self.chain.utxos.balance(pub_key), sum(utxo.val for utxo in owned))
+        # outputs of the last block were not spent yet, the earlier ones were spent at most once
+        self.assertTrue(all(utxo.id in self.chain.utxos for tx in self.chain.head.txs for utxo in tx.vout))
+        vins = [utxo.id for block in self.chain.chain for tx in block.txs for utxo in tx.vin]
+        self.assertEqual(len(vins), len(spent))
+
+    def test_utxo_set_spend(self):
+        utxos = bs.UTXOSet()
+        for block in self.chain.chain:
+            utxos.apply_block(block)
+        utxo = self.chain.head.txs[0].vout[0]
+        balance = utxos.balance(utxo.pub_key)
+        self.assertIs(utxos.spend(utxo.id), utxo)
+        self.assertNotIn(utxo.id, utxos)
+        self.assertIsNone(utxos.spend(utxo.id))
+        self.assertEqual(utxos.balance(utxo.pub_key), balance - utxo.val)
+        self.assertNotIn(utxo, utxos.unspent(utxo.pub_key))
+        self.assertEqual(utxos.balance("no such key"), 0)
+
+def iter_runs(interlink):
+    run = interlink.runs
+    while run is not None:
+        yield run
+        run = run.above
+
+
+if __name__ == "__main__":
+    unittest.main()
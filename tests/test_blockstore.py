@@ -0,0 +1,104 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+import miner
+import nipopow
+import blockstore
+import blockchain_structs as bs
+from fullnode import FullNode
+
+"""
+This file tests the append-only block store and reloading a chain from it.
+
+Run: python -m unittest tests/test_blockstore.py
+"""
+
+DIFFICULTY = 0x1FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF
+
+def mine_next(chain: bs.Blockchain):
+    block = bs.Block(chain.head, [miner.create_coinbase_tx(miner.MINER[1], 25)], chain.height + 1)
+    block.interlink = nipopow.Interlink(chain.chain[0])
+    block.interlink.update_interlink(chain.head, DIFFICULTY)
+    return miner.find_pow(block, DIFFICULTY)
+
+class TestBlockStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "chain.dat")
+        self.store = blockstore.BlockStore(self.path, 25, DIFFICULTY)
+        self.chain = miner.generate_blockchain(30, 25, DIFFICULTY, store=self.store)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def reopen(self):
+        self.store.close()
+        self.store = blockstore.BlockStore(self.path)
+        return bs.Blockchain.from_store(self.store)
+
+    def test_reloaded_chain(self):
+        reloaded = self.reopen()
+        self.assertEqual((reloaded.coinbase, reloaded.difficulty), (25, DIFFICULTY))
+        self.assertEqual(len(reloaded.chain), len(self.chain.chain))
+        for block, stored in zip(self.chain.chain, reloaded.chain):
+            self.assertEqual(stored.block_hash, block.block_hash)
+            self.assertEqual(stored.compute_hash(), block.block_hash)
+            self.assertEqual(stored.level, block.level)
+            self.assertEqual([tx.tx_id for tx in stored.txs], [tx.tx_id for tx in block.txs])
+            self.assertEqual(stored.interlink and stored.interlink.interlink, block.interlink and block.interlink.interlink)
+        self.assertEqual(reloaded.tx_index, self.chain.tx_index)
+        self.assertEqual(reloaded.superchains, self.chain.superchains)
+        self.assertEqual(reloaded.utxos.outputs.keys(), self.chain.utxos.outputs.keys())
+        self.assertEqual(reloaded.utxos.balances, self.chain.utxos.balances)
+        # interlinks read in order share their upper levels again
+        block = reloaded.chain[-1]
+        above = block.interlink.runs.above
+        run = block.prev_block.interlink.runs
+        while run is not None and run is not above:
+            run = run.above
+        self.assertIs(run, above)
+
+    def test_reads_by_height_and_hash(self):
+        for height in (0, 1, 17, 31):
+            block = self.chain.chain[height]
+            self.assertEqual(self.store.read_block(height).block_hash, block.block_hash)
+            self.assertEqual(self.store.get(block.block_hash).interlink and self.store.get(block.block_hash).interlink.interlink,
+                block.interlink and block.interlink.interlink)
+        self.assertIsNone(self.store.get("not a block"))
+        with self.assertRaises(IndexError):
+            self.store.read_block(len(self.chain.chain))
+
+    def test_record_outlives_store(self):
+        record = self.store.read_record(17)
+        self.store.close()
+        self.assertEqual(blockstore.decode_block(record).block_hash, self.chain.chain[17].block_hash)
+        self.store = blockstore.BlockStore(self.path)
+
+    def test_reloaded_chain_keeps_growing(self):
+        reloaded = self.reopen()
+        for _ in range(3):
+            reloaded.add_block(mine_next(reloaded))
+        self.assertEqual(len(self.store), len(reloaded.chain))
+        self.assertEqual([block.block_hash for block in self.reopen().chain], [block.block_hash for block in reloaded.chain])
+        fullnode = FullNode(reloaded)
+        self.assertTrue(fullnode.get_path(reloaded.chain[10].txs[2].tx_id))
+
+    def test_partial_write_is_dropped(self):
+        self.store.close()
+        with open(self.path, "ab") as fp:
+            fp.write(b"half a block")
+        with open(self.path + ".idx", "ab") as fp:
+            fp.write(b"half")
+        self.store = blockstore.BlockStore(self.path)
+        self.assertEqual(len(self.store), len(self.chain.chain))
+        reloaded = bs.Blockchain.from_store(self.store)
+        reloaded.add_block(mine_next(reloaded))
+        self.assertEqual(self.reopen().head.block_hash, reloaded.head.block_hash)
+
+
+if __name__ == "__main__":
+    unittest.main()
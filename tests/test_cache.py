@@ -0,0 +1,26 @@
+import os
+import sys
+import unittest
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+from cache import LRUCache
+
+"""
+This file tests the LRU cache used by the full node.
+
+Run: python -m unittest tests/test_cache.py
+"""
+
+class TestLRUCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1) # "b" is now the least recently used
+        cache.put("c", 3)
+        self.assertNotIn("b", cache)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats(), {"size": 2, "maxsize": 2, "hits": 1, "misses": 1, "evictions": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
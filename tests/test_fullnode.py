@@ -0,0 +1,97 @@
+import os
+import sys
+import unittest
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+import miner
+import nipopow
+import proof_codec
+import blockchain_structs as bs
+from fullnode import FullNode
+
+"""
+This file tests the full node's proof generation and the caches it keeps for it.
+
+Run: python -m unittest tests/test_fullnode.py
+"""
+
+DIFFICULTY = 0x1FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF
+
+def mine_next(chain: bs.Blockchain):
+    block = bs.Block(chain.head, [miner.create_coinbase_tx(miner.MINER[1], 25)], chain.height + 1)
+    block.interlink = nipopow.Interlink(chain.chain[0])
+    block.interlink.update_interlink(chain.head, DIFFICULTY)
+    return miner.find_pow(block, DIFFICULTY)
+
+def heights(proof):
+    if isinstance(proof, list):
+        return [heights(item) for item in proof]
+    return proof.height
+
+class TestSuffixProofCache(unittest.TestCase):
+    def test_cached_proof_follows_new_blocks(self):
+        fullnode = FullNode(miner.generate_blockchain(2, 25, DIFFICULTY))
+        fullnode.set_difficulty(DIFFICULTY)
+        for _ in range(60):
+            fullnode.add_block(mine_next(fullnode.blockchain))
+            for k, m in ((1, 1), (3, 3), (6, 2)):
+                expected = nipopow.suffix_proof(fullnode.blockchain, k, m, DIFFICULTY)
+                self.assertEqual(heights(fullnode.get_suffix_proof(k, m)), heights(expected))
+
+    def test_block_with_invalid_input_is_rejected(self):
+        fullnode = FullNode(miner.generate_blockchain(2, 25, DIFFICULTY))
+        output = fullnode.blockchain.utxos.unspent(miner.ADDRESSES[0][1])[0]
+        # spends an output of the first address, signed with the key of the second one
+        utxo = bs.UTXO(output.val, output.pub_key, *output.id)
+        utxo.sign_utxo(miner.ADDRESSES[1][0])
+        block = mine_next(fullnode.blockchain)
+        block.add_tx(bs.Transaction([utxo], [bs.UTXO(output.val, miner.ADDRESSES[1][1])]).set_tx_id())
+        height = fullnode.blockchain.height
+        with self.assertRaises(ValueError):
+            fullnode.add_block(block)
+        self.assertEqual(fullnode.blockchain.height, height)
+
+class TestBatchProof(unittest.TestCase):
+    k = 3
+    m = 3
+    chain = miner.generate_blockchain(80, 25, DIFFICULTY)
+
+    def setUp(self):
+        self.fullnode = FullNode(self.chain)
+        self.fullnode.set_difficulty(DIFFICULTY)
+
+    def test_batch_merges_single_proofs(self):
+        txns = [self.chain.chain[height].txs[0].tx_id for height in (5, 17, 40, 41, 79)]
+        batch = self.fullnode.get_batch_nipopow_proof(self.k, self.m, txns)
+        merged = set()
+        for txn in txns:
+            merged.update(block.height for block in self.fullnode.get_nipopow_proof(self.k, self.m, txn)[-1])
+        self.assertEqual(heights(batch[2]), sorted(merged, reverse=True))
+        self.assertEqual([heights(predicate) for predicate in batch[3]], [[5], [17], [40], [41], [79]])
+
+    def test_batch_verifies_in_one_pass(self):
+        stored = self.fullnode.get_top_chain(self.m, self.k, DIFFICULTY)
+        txns = [self.chain.chain[height].txs[0].tx_id for height in (3, 30, 60)] + ["not a tx"]
+        proof = proof_codec.decode_proof(self.fullnode.get_encoded_batch_nipopow_proof(self.k, self.m, txns))
+        results = nipopow.verify_batch_infix(proof, stored, self.k, self.chain.chain[0], txns)
+        self.assertEqual(results, {txns[0]: True, txns[1]: True, txns[2]: True, "not a tx": False})
+        self.assertFalse(any(nipopow.verify_batch_infix(proof, stored, self.k, self.chain.chain[0], txns[:2]).values()))
+
+    def test_malformed_batch(self):
+        stored = self.fullnode.get_top_chain(self.m, self.k, DIFFICULTY)
+        txns = [self.chain.chain[height].txs[0].tx_id for height in (3, 30)]
+        prefix, extra, chain, predicates = self.fullnode.get_batch_nipopow_proof(self.k, self.m, txns)
+        block = chain[0]
+        shapes = [[prefix, extra, chain], [prefix, extra, [], predicates], [[], extra, chain, predicates],
+            [prefix, [[block]], chain, predicates], [prefix, extra, chain, [block, block]], [prefix, extra, chain, [[block, block], []]],
+            [prefix, extra, chain, predicates, []], block, []]
+        for shape in shapes:
+            results = nipopow.verify_batch_infix(shape, stored, self.k, self.chain.chain[0], txns)
+            self.assertEqual(results, {txn: False for txn in txns})
+        # the decoder already rejects those that are not an infix proof either
+        for shape in shapes[1:-2]:
+            with self.assertRaises(ValueError):
+                proof_codec.decode_proof(proof_codec.encode_proof(shape))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+import miner
+import headerstore
+from fullnode import FullNode
+from spv import SPV
+
+"""
+This file tests the SPV client's fixed-record header file.
+
+Run: python -m unittest tests/test_headerstore.py
+"""
+
+DIFFICULTY = 0x1FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF
+
+class TestHeaderStore(unittest.TestCase):
+    chain = miner.generate_blockchain(12, 25, DIFFICULTY)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "headers")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_records_match_chain_headers(self):
+        with headerstore.HeaderStore(self.path) as headers:
+            self.assertEqual(headers.sync(self.chain), len(self.chain.chain))
+            self.assertEqual(os.path.getsize(self.path), len(self.chain.chain) * headerstore.RECORD.size)
+            for block, header in zip(self.chain.chain, headers):
+                self.assertEqual(header, dict(self.chain.headers[block.height], hash=block.block_hash))
+            self.assertEqual(headers[-1]["hash"], self.chain.head.block_hash)
+            with self.assertRaises(IndexError):
+                headers[len(self.chain.chain)]
+
+    def test_sync_appends_only_new_headers(self):
+        partial = miner.generate_blockchain(0, 25, DIFFICULTY)
+        with headerstore.HeaderStore(self.path) as headers:
+            headers.sync(self.chain)
+            with self.assertRaises(ValueError):
+                headers.sync(partial)
+        # a partly written record is dropped when the file is reopened
+        with open(self.path, "ab") as fp:
+            fp.write(b"partial")
+        with headerstore.HeaderStore(self.path) as headers:
+            self.assertEqual(len(headers), len(self.chain.chain))
+            self.assertEqual(headers.sync(self.chain), 0)
+
+    def test_spv_verifies_with_stored_headers(self):
+        with headerstore.HeaderStore(self.path) as headers:
+            wallet = SPV(FullNode(self.chain), headers)
+            wallet.sync_headers()
+            tids = [self.chain.chain[height].txs[2].tx_id for height in (2, 7, 13)]
+            for tid in tids:
+                self.assertTrue(wallet.verify_transaction(tid))
+            self.assertEqual(wallet.verify_transactions(tids), {tid: True for tid in tids})
+
+
+if __name__ == "__main__":
+    unittest.main()
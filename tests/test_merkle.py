@@ -0,0 +1,148 @@
+import os
+import sys
+import unittest
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+import merkle
+
+"""
+This file tests the merkle tree used for block merkle roots and SPV paths.
+
+Run: python -m unittest tests/test_merkle.py
+"""
+
+def reference_root(digests):
+    # recursive top-down split of the original implementation, the array tree must give the same root
+    if len(digests) == 2:
+        return merkle.hash_pair(digests[0], digests[1])
+    split_id = len(digests) - 2**(len(digests).bit_length() - 1) // 2
+    return merkle.hash_pair(reference_root(digests[:split_id]), reference_root(digests[split_id:]))
+
+def build_tree(values):
+    tree = merkle.MerkleTree()
+    for value in values:
+        tree.addNode(value)
+    tree.initialize()
+    return tree
+
+class TestMerkleTree(unittest.TestCase):
+    def test_empty_tree(self):
+        tree = build_tree([])
+        self.assertIsNone(tree.root)
+        self.assertIsNone(tree.get_path("a"))
+
+    def test_root_matches_recursive_split(self):
+        for size in range(1, 70):
+            values = [f"tx{i}" for i in range(size)]
+            digests = [merkle.hash_leaf(value) for value in values]
+            if size % 2 == 1:
+                digests.append(digests[-1])
+            self.assertEqual(build_tree(values).root, reference_root(digests))
+
+    def test_paths_lead_to_root(self):
+        for size in (1, 2, 5, 6, 14, 33, 100):
+            values = [f"tx{i}" for i in range(size)]
+            tree = build_tree(values)
+            for index, value in enumerate(values):
+                proof = tree.get_path(value)
+                self.assertEqual(proof.leaf_index, index)
+                hashed = merkle.hash_leaf(value)
+                for sibling in proof.path:
+                    hashed = merkle.hash_pair(hashed, sibling)
+                self.assertEqual(hashed, tree.root)
+                self.assertTrue(proof.verify(tree.root))
+
+    def test_unknown_value(self):
+        tree = build_tree(["a", "b", "c"])
+        self.assertIsNone(tree.get_path("d"))
+
+    def test_duplicated_last_leaf(self):
+        # "c" is the odd leaf, its sibling is its own duplicate
+        tree = build_tree(["a", "b", "c"])
+        proof = tree.get_path("c")
+        self.assertEqual(proof.path[0], merkle.hash_leaf("c"))
+        self.assertTrue(proof.verify(tree.root))
+
+    def test_multiproof(self):
+        for size in (1, 2, 5, 14, 33, 100):
+            values = [f"tx{i}" for i in range(size)]
+            tree = build_tree(values)
+            for picked in (values[:1], values[-1:], values[::3], values):
+                proof = tree.get_multiproof(picked)
+                self.assertTrue(proof.verify(tree.root))
+                single_hashes = set(h for value in picked for h in tree.get_path(value).path)
+                self.assertLessEqual(len(proof.hashes), len(single_hashes))
+        self.assertIsNone(build_tree(["a", "b"]).get_multiproof(["a", "c"]))
+
+    def test_ordered_multiproof(self):
+        # the ordered hash does not commute, so every right child must be folded on the right
+        for size in (1, 2, 5, 7, 14, 33):
+            tree = merkle.OrderedMerkleTree()
+            for i in range(size):
+                tree.addNode(f"link{i}")
+            tree.initialize(verbose=False)
+            for indices in ([0], [size - 1], list(range(1, size, 2)) or [0], list(range(size))):
+                leaves = {i: merkle.hash_ordered_leaf(f"link{i}") for i in indices}
+                hashes = tree.get_multiproof_hashes(indices)
+                self.assertEqual(merkle.multiproof_root(size, leaves, hashes, merkle.hash_ordered_pair), tree.root)
+        self.assertNotEqual(merkle.hash_ordered_pair("00" * 20, "11" * 20), merkle.hash_ordered_pair("11" * 20, "00" * 20))
+
+    def test_ordered_proofs(self):
+        # proofs taken from an ordered tree recompute its root with its hashes
+        for size in (1, 2, 5, 7, 14, 33):
+            tree = merkle.OrderedMerkleTree()
+            values = [f"link{i}" for i in range(size)]
+            for value in values:
+                tree.addNode(value)
+            tree.initialize(verbose=False)
+            for value in values:
+                self.assertTrue(tree.get_path(value).verify(tree.root))
+            self.assertTrue(tree.get_multiproof(values[::2]).verify(tree.root))
+        proof = tree.get_path("link5")
+        proof.path = [proof.path[1], proof.path[0]] + proof.path[2:]
+        self.assertFalse(proof.verify(tree.root))
+
+    def test_multiproof_wrong_leaf(self):
+        tree = build_tree([f"tx{i}" for i in range(10)])
+        proof = tree.get_multiproof(["tx2", "tx7"])
+        leaves = {2: merkle.hash_leaf("tx2"), 7: merkle.hash_leaf("other")}
+        self.assertNotEqual(merkle.multiproof_root(proof.leaf_count, leaves, proof.hashes), tree.root)
+
+    def test_multiproof_hash_count(self):
+        tree = build_tree([f"tx{i}" for i in range(10)])
+        proof = tree.get_multiproof(["tx2", "tx7"])
+        leaves = {2: merkle.hash_leaf("tx2"), 7: merkle.hash_leaf("tx7")}
+        self.assertEqual(merkle.multiproof_root(proof.leaf_count, leaves, proof.hashes), tree.root)
+        # too few hashes, one left over, a leaf outside the tree
+        self.assertIsNone(merkle.multiproof_root(proof.leaf_count, leaves, proof.hashes[:-1]))
+        self.assertIsNone(merkle.multiproof_root(proof.leaf_count, leaves, proof.hashes + [tree.root]))
+        self.assertIsNone(merkle.multiproof_root(proof.leaf_count, {10: merkle.hash_leaf("tx2")}, proof.hashes))
+
+class TestIncrementalMerkleTree(unittest.TestCase):
+    def test_root_matches_initialize(self):
+        tree = merkle.IncrementalMerkleTree()
+        values = []
+        for i in range(300):
+            values.append(f"tx{i}")
+            self.assertEqual(tree.append(values[-1]), build_tree(values).root)
+
+    def test_unused_subtrees_are_dropped(self):
+        tree = merkle.IncrementalMerkleTree()
+        values = [f"tx{i}" for i in range(3000)]
+        for value in values:
+            tree.append(value)
+        tree._sweep()
+        live = tree._live_from(len(tree) + 1)
+        self.assertGreater(live, 0)
+        self.assertTrue(all(start >= live for level in tree.nodes for start in level))
+        self.assertTrue(all(size >= live for size in tree.roots))
+        # what is left is enough for the appends that follow
+        for i in range(3000, 4200):
+            values.append(f"tx{i}")
+            tree.append(values[-1])
+            if i % 199 == 0:
+                self.assertEqual(tree.root, build_tree(values).root)
+        self.assertEqual(tree.root, build_tree(values).root)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,8 @@
 import unittest
 import time
+import os
 import sys
-sys.path.insert(1, "/Users/colet/pyth_blockchain/src")
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
 import miner
 import blockchain_structs as bs
 from hashlib import sha1
@@ -9,8 +10,6 @@ from hashlib import sha1
 This file tests functions of a miner.
 This includes finding block solutions and verifying/routing blocks and txs.
 
-### Change the sys.path to wherever the src directoy is stored on your system ###
-
 Run: python -m unittest tests/test_miner.py
 """
 
@@ -26,12 +25,117 @@ class TestBlockMine(unittest.TestCase):
     # find and validate a proof of work
     def test_mine_valid_block(self):
         solution = TestBlockMine.create_mine(0x0FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF)
-        self.assertGreater(0x0FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF, int(sha1(solution.to_json().encode()).hexdigest(), 16))
+        self.assertGreater(0x0FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF, int(solution.compute_hash(), 16))
     
     # check an invalid pow of work (lower difficulty)
     def test_mine_invalid_block(self):
         solution = TestBlockMine.create_mine(0x0FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF)
-        self.assertGreater(int(sha1(solution.to_json().encode()).hexdigest(), 16), 0x00000FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF)
+        self.assertGreater(int(solution.compute_hash(), 16), 0x00000FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF)
+
+    # the pool must return the same solution as the single process search
+    def test_pool_matches_find_pow(self):
+        block = bs.Block(None, [], 0)
+        pool_block = bs.Block(None, [], 0)
+        pool_block.timestamp = block.timestamp
+        miner.find_pow(block, 0x00FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF)
+        with miner.MiningPool(2, range_size=2**8, local_attempts=0) as pool:
+            pool.find_pow(pool_block, 0x00FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF)
+        self.assertEqual(block.nonce, pool_block.nonce)
+        self.assertEqual(block.block_hash, pool_block.block_hash)
+        self.assertEqual(pool_block.block_hash, pool_block.compute_hash())
+
+
+def spend(utxo: bs.UTXO, priv_key: str, value: int = None):
+    # tx sending utxo (or value of it) to the first address
+    utxo.sign_utxo(priv_key)
+    return bs.Transaction([utxo], [bs.UTXO(utxo.val if value is None else value, miner.ADDRESSES[0][1])]).set_tx_id()
+
+class TestVerifyBlock(unittest.TestCase):
+    chain = miner.generate_blockchain(5, 25, 0x3FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF)
+
+    def setUp(self):
+        # two outputs of the second address, as a previous block would have left them
+        self.utxos = bs.UTXOSet()
+        tx = bs.Transaction([], [bs.UTXO(10, miner.ADDRESSES[1][1]), bs.UTXO(5, miner.ADDRESSES[1][1])]).set_tx_id()
+        bs.set_utxo_txid([tx])
+        for utxo in tx.vout:
+            self.utxos.add(utxo)
+        self.outputs = tx.vout
+
+    def copy_output(self, index):
+        utxo = self.outputs[index]
+        return bs.UTXO(utxo.val, utxo.pub_key, *utxo.id)
+
+    def test_generated_chain_verifies(self):
+        with miner.VerifierPool(2) as pool:
+            for verifier in (None, pool):
+                utxos = bs.UTXOSet()
+                for block in self.chain.chain:
+                    self.assertTrue(miner.verify_block(block, utxos, verifier))
+                    utxos.apply_block(block)
+
+    def test_invalid_inputs(self):
+        owner = miner.ADDRESSES[1][0]
+        valid = bs.Block(None, [spend(self.copy_output(0), owner)], 1)
+        self.assertTrue(miner.verify_block(valid, self.utxos))
+        self.assertTrue(miner.verify_UTXO(valid.txs[0].vin[0], self.utxos))
+        # signed by a key that doesn't own the output
+        self.assertFalse(miner.verify_block(bs.Block(None, [spend(self.copy_output(0), miner.ADDRESSES[2][0])], 1), self.utxos))
+        # spending more than the output holds, spending it twice, spending an output that isn't in the set
+        self.assertFalse(miner.verify_block(bs.Block(None, [spend(self.copy_output(0), owner, 11)], 1), self.utxos))
+        twice = [spend(self.copy_output(0), owner), spend(self.copy_output(0), owner)]
+        self.assertFalse(miner.verify_block(bs.Block(None, twice, 1), self.utxos))
+        self.assertFalse(miner.verify_block(bs.Block(None, [spend(bs.UTXO(10, miner.ADDRESSES[1][1]), owner)], 1), self.utxos))
+
+    def test_pool_fails_fast(self):
+        owner = miner.ADDRESSES[1][0]
+        signatures = miner.input_signatures(bs.Block(None, [spend(self.copy_output(0), owner)], 1), self.utxos) * 40
+        pub_key, message, sig = signatures[0]
+        with miner.VerifierPool(2, chunk_size=4) as pool:
+            self.assertTrue(pool.verify(signatures))
+            self.assertFalse(pool.verify(signatures[:3] + [(pub_key, message + b"x", sig)] + signatures))
+            # the next batch isn't affected by the failed one
+            self.assertTrue(pool.verify(signatures))
+
+
+class RecordingPool:
+    # stands in for a VerifierPool, keeps the signatures it is asked to verify
+    def __init__(self):
+        self.batches = []
+
+    def verify(self, signatures):
+        self.batches.append(signatures)
+        return all(miner.verify_signature(*signature) for signature in signatures)
+
+class TestSignatureCache(unittest.TestCase):
+    def setUp(self):
+        miner.verified_signatures.clear()
+        output = bs.UTXO(25, miner.ADDRESSES[1][1], sha1(b"cached").hexdigest(), 0)
+        self.utxos = bs.UTXOSet()
+        self.utxos.add(output)
+        self.input = bs.UTXO(25, output.pub_key, *output.id)
+        self.block = bs.Block(None, [spend(self.input, miner.ADDRESSES[1][0])], 1)
+
+    def test_valid_signature_is_verified_once(self):
+        self.assertTrue(miner.verify_UTXO(self.input, self.utxos))
+        hits = miner.signature_cache_stats()["hits"]
+        # the input was checked before its block came in
+        self.assertTrue(miner.verify_block(self.block, self.utxos))
+        self.assertEqual(miner.signature_cache_stats()["hits"], hits + 1)
+        pool = RecordingPool()
+        self.assertTrue(miner.verify_block(self.block, self.utxos, pool))
+        self.assertEqual(pool.batches, [[]])
+
+    def test_invalid_signature_is_not_cached(self):
+        pub_key, message, sig = miner.input_signatures(self.block, self.utxos)[0]
+        for _ in range(2):
+            self.assertFalse(miner.verify_signature(pub_key, message + b"x", sig))
+        self.assertEqual(len(miner.verified_signatures), 0)
+        pool = RecordingPool()
+        self.assertTrue(miner.verify_block(self.block, self.utxos, pool))
+        self.assertEqual(pool.batches, [[(pub_key, message, sig)]])
+        self.assertEqual(len(miner.verified_signatures), 1)
+
 
 
 if __name__ == "__main__":
@@ -21,7 +21,7 @@ class TestGoodVerification(unittest.TestCase):
         # security parameters
         self.k = 2
         self.m = 3
-        self.stored_chain = get_superchain(chain.chain, find_top_chain(chain, 3, difficulty, k), difficulty, k)
+        self.stored_chain = get_superchain(chain, find_top_chain(chain, 3, difficulty, k), difficulty, k)
         output_blockhashes(chain, difficulty)
         print("Super Block Distribution:", get_super_dist(chain, difficulty, k))
 
@@ -0,0 +1,195 @@
+import os
+import sys
+import unittest
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+import blockchain_structs as bs
+import merkle
+import miner
+import nipopow
+import proof_codec
+from fullnode import FullNode
+from nipopow_client import NiPoPow_Client
+
+"""
+This file tests the binary wire format of NiPoPoW proofs.
+
+Run: python -m unittest tests/test_proof_codec.py
+"""
+
+class TestProofCodec(unittest.TestCase):
+    difficulty = 0x3FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF
+    k = 3
+    m = 3
+    chain = miner.generate_blockchain(40, 25, difficulty)
+
+    def encoded_infix(self, height, mode=proof_codec.COMMITTED):
+        fullnode = FullNode(self.chain)
+        fullnode.set_difficulty(self.difficulty)
+        return fullnode.get_encoded_nipopow_proof(self.k, self.m, self.chain.chain[height].txs[0].tx_id, mode)
+
+    def stored_chain(self):
+        return nipopow.get_superchain(self.chain, nipopow.find_top_chain(self.chain, self.m, self.difficulty, self.k), self.difficulty, self.k)
+
+    def test_decoded_proof_verifies(self):
+        stored = self.stored_chain()
+        for mode in (proof_codec.FULL, proof_codec.COMMITTED):
+            for height in (1, 10, 25, 40):
+                txn = self.chain.chain[height].txs[0].tx_id
+                proof = proof_codec.decode_proof(self.encoded_infix(height, mode))
+                self.assertTrue(nipopow.verify_infix(proof, stored, self.k, self.chain.chain[0], txn))
+
+    def test_verification_leaves_proof_intact(self):
+        stored = self.stored_chain()
+        txn = self.chain.chain[30].txs[0].tx_id
+        proof = proof_codec.decode_proof(self.encoded_infix(30))
+        structure = [len(part) for part in proof]
+        for _ in range(2):
+            self.assertTrue(nipopow.verify_infix(proof, stored, self.k, self.chain.chain[0], txn))
+        self.assertEqual([len(part) for part in proof], structure)
+
+    def test_unanchored_chain(self):
+        proof = proof_codec.decode_proof(self.encoded_infix(30))
+        other_genesis = miner.generate_blockchain(0, 25, self.difficulty).chain[0]
+        self.assertFalse(nipopow.validate_chain(proof[-1], other_genesis))
+
+    def committed_interlink(self):
+        # the last block's interlink as a proof sends it committed, proving its first level
+        interlink = self.chain.chain[-1].interlink
+        committed = nipopow.commit_interlink(interlink, {interlink[0]})
+        return nipopow.CommittedInterlink(committed.root, committed.size, committed.links, committed.hashes)
+
+    def test_broken_link(self):
+        genesis = self.chain.chain[0]
+        chain = self.chain.chain[::-1]
+        self.assertTrue(nipopow.validate_chain(chain, genesis))
+        # without block h, block h + 1 only reaches block h - 1 through a level above block h's own
+        height = next(h for h in range(2, len(self.chain.chain) - 1) if self.chain.chain[h].level >= self.chain.chain[h - 1].level)
+        self.assertFalse(nipopow.validate_chain([block for block in chain if block.height != height], genesis))
+        self.assertFalse(nipopow.validate_chain(chain[::7], genesis))
+
+    def test_foreign_block_in_proof(self):
+        stored = self.stored_chain()
+        txn = self.chain.chain[20].txs[0].tx_id
+        proof = nipopow.infix_proof(self.chain, self.k, self.m, self.difficulty, txn)
+        self.assertTrue(nipopow.verify_infix(proof, stored, self.k, self.chain.chain[0], txn))
+        # a block forking off the chain at a height the proof skips, anchored to the same genesis
+        heights = set(block.height for block in proof[-1])
+        height = next(h for h in range(21, len(self.chain.chain)) if h not in heights)
+        prev = self.chain.chain[height - 1]
+        foreign = bs.Block(prev, [], height)
+        foreign.interlink = nipopow.Interlink(self.chain.chain[0])
+        foreign.interlink.update_interlink(prev, self.difficulty)
+        foreign = miner.find_pow(foreign, self.difficulty)
+        proof[-1] = sorted(proof[-1] + [foreign], key=lambda block: block.height, reverse=True)
+        self.assertFalse(nipopow.verify_infix(proof, stored, self.k, self.chain.chain[0], txn))
+
+    def test_tampered_interlink_proof(self):
+        interlink = self.committed_interlink()
+        linked = next(iter(interlink.links.values()))
+        interlink.hashes = [interlink.hashes[0][::-1]] + interlink.hashes[1:]
+        self.assertFalse(interlink.contains(linked))
+
+    def test_forged_interlink_link(self):
+        honest = self.committed_interlink()
+        level, linked = next(iter(honest.links.items()))
+        leaf = int(merkle.hash_ordered_leaf(linked), 16)
+        tried = 0
+        # with an additive node hash, leaf + sibling - fake leaf as the sibling keeps every parent the same
+        for fake in (f"{n:040x}" for n in range(50)):
+            for i, sibling in enumerate(honest.hashes):
+                forged_sibling = leaf + int(sibling, 16) - int(merkle.hash_ordered_leaf(fake), 16)
+                if not 0 <= forged_sibling < 1 << 160:
+                    continue
+                tried += 1
+                hashes = honest.hashes[:i] + [f"{forged_sibling:040x}"] + honest.hashes[i + 1:]
+                forged = nipopow.CommittedInterlink(honest.root, honest.size, {**honest.links, level: fake}, hashes)
+                self.assertFalse(forged.contains(fake))
+        self.assertGreater(tried, 0)
+
+    def test_committed_never_larger_than_full(self):
+        for height in (1, 10, 25, 40):
+            proof = nipopow.infix_proof(self.chain, self.k, self.m, self.difficulty, self.chain.chain[height].txs[0].tx_id)
+            self.assertLessEqual(proof_codec.proof_size(proof), proof_codec.proof_size(proof, proof_codec.FULL))
+
+    def test_blocks_are_encoded_once(self):
+        proof = nipopow.suffix_proof(self.chain, self.k, self.m, self.difficulty)
+        decoded = proof_codec.decode_proof(proof_codec.encode_proof(proof))
+        self.assertEqual(decoded, proof)
+        # a block in several levels of the proof decodes to one header object
+        headers = {}
+        for block in [block for subchain in decoded[0] + [decoded[1]] for block in subchain]:
+            self.assertIs(headers.setdefault(block.block_hash, block), block)
+
+    def test_tampered_header(self):
+        data = bytearray(self.encoded_infix(20))
+        data[proof_codec._PREAMBLE.size + 30] ^= 1 # inside the first header's prev hash
+        with self.assertRaises(ValueError):
+            proof_codec.decode_proof(bytes(data))
+
+    def test_truncated_proof(self):
+        for mode in (proof_codec.FULL, proof_codec.COMMITTED):
+            data = self.encoded_infix(20, mode)
+            for length in range(len(data)):
+                with self.assertRaises(ValueError):
+                    proof_codec.decode_proof(data[:length])
+            with self.assertRaises(ValueError):
+                proof_codec.decode_proof(data + b"\x00")
+
+    def test_corrupted_proof(self):
+        data = self.encoded_infix(20)
+        for offset in range(len(data)):
+            corrupted = bytearray(data)
+            corrupted[offset] ^= 0xFF
+            # some flips still decode (an interlink hash, a timestamp), none may fail with anything but ValueError
+            try:
+                proof_codec.decode_proof(bytes(corrupted))
+            except ValueError:
+                pass
+
+    def test_header_index_out_of_range(self):
+        data = bytearray(self.encoded_infix(20))
+        count = proof_codec._PREAMBLE.unpack_from(data, 0)[3]
+        node = proof_codec._NODE.pack(proof_codec._BLOCK, count)
+        # the last node of the structure is a block, point it past the header table
+        with self.assertRaises(ValueError):
+            proof_codec.decode_proof(bytes(data[:-len(node)] + node))
+
+    def client_for(self, responses):
+        # a client whose node answers with each of responses in turn
+        fullnode = FullNode(self.chain)
+        fullnode.set_difficulty(self.difficulty)
+        responses = iter(responses)
+        fullnode.get_encoded_nipopow_proof = lambda *args: next(responses)
+        client = NiPoPow_Client(fullnode)
+        client.set_superchain(self.stored_chain())
+        client.set_genesis(self.chain.chain[0])
+        return client
+
+    def test_client_rejects_malformed_layout(self):
+        txn = self.chain.chain[20].txs[0].tx_id
+        prefix, extra, chain = nipopow.infix_proof(self.chain, self.k, self.m, self.difficulty, txn)
+        block = chain[0]
+        shapes = [[[]], [block], [prefix, extra, []], [prefix, extra], [[], extra, chain], [prefix, [[block]], chain],
+            [[block], extra, chain], [prefix, extra, [[block]]], [prefix, extra, chain, [[block, block]]]]
+        for shape in shapes:
+            data = proof_codec.encode_proof(shape)
+            if len(shape) != 2: # a suffix proof is a valid layout, but not what verify_transaction asked for
+                with self.assertRaises(ValueError):
+                    proof_codec.decode_proof(data)
+        client = self.client_for(proof_codec.encode_proof(shape) for shape in shapes)
+        for _ in shapes:
+            self.assertFalse(client.verify_transaction(txn))
+
+    def test_client_rejects_truncated_response(self):
+        fullnode = FullNode(self.chain)
+        fullnode.set_difficulty(self.difficulty)
+        honest = fullnode.get_encoded_nipopow_proof
+        fullnode.get_encoded_nipopow_proof = lambda *args: honest(*args)[:-7]
+        client = NiPoPow_Client(fullnode)
+        client.set_superchain(self.stored_chain())
+        client.set_genesis(self.chain.chain[0])
+        self.assertFalse(client.verify_transaction(self.chain.chain[20].txs[0].tx_id))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import unittest
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+import miner
+from fullnode import FullNode
+from spv import SPV
+
+"""
+This file tests that the SPV client only trusts what the full node's proofs show.
+
+Run: python -m unittest tests/test_spv.py
+"""
+
+DIFFICULTY = 0x1FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF
+
+class LyingNode(FullNode):
+    # answers a batch with the proof of the real transaction, claiming the fake ones sit on its leaf
+    def __init__(self, blockchain, real, fakes, change = None):
+        super().__init__(blockchain)
+        self.real = real
+        self.fakes = fakes
+        self.change = change or (lambda proof: None)
+
+    def get_multipath(self, tids):
+        proofs = super().get_multipath([self.real])
+        for fake in self.fakes:
+            proofs[0]["indices"][fake] = proofs[0]["indices"][self.real]
+        self.change(proofs[0])
+        return proofs
+
+class TestVerifyTransactions(unittest.TestCase):
+    chain = miner.generate_blockchain(4, 25, DIFFICULTY)
+
+    def setUp(self):
+        self.real = self.chain.chain[3].txs[2].tx_id
+
+    def verify(self, node, tids):
+        return SPV(node, self.chain.headers).verify_transactions(tids)
+
+    def test_honest_node(self):
+        tids = [self.real, self.chain.chain[4].txs[1].tx_id, "not a tx"]
+        self.assertEqual(self.verify(FullNode(self.chain), tids), {tids[0]: True, tids[1]: True, "not a tx": False})
+
+    def test_fake_tid_on_real_leaf(self):
+        self.assertEqual(self.verify(LyingNode(self.chain, self.real, ["FAKE_TX"]), [self.real, "FAKE_TX"]),
+            {self.real: False, "FAKE_TX": False})
+        # tids not asked about are not reported
+        self.assertEqual(self.verify(LyingNode(self.chain, self.real, ["OTHER_TX"]), [self.real]), {self.real: True})
+
+    def test_malformed_proofs(self):
+        def out_of_range(proof):
+            proof["indices"][self.real] = proof["leaf_count"]
+        def short(proof):
+            proof["hashes"] = proof["hashes"][:-1]
+        def bad_block(proof):
+            proof["blockid"] = len(self.chain.chain)
+        for change in (out_of_range, short, bad_block):
+            self.assertEqual(self.verify(LyingNode(self.chain, self.real, [], change), [self.real]), {self.real: False})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,14 @@
 import unittest
 import time
+import os
 import sys
 import copy
-from ecdsa import SigningKey, VerifyingKey, NIST192p
+from ecdsa import SigningKey, VerifyingKey, NIST192p, BadSignatureError
 
-sys.path.insert(1, "/Users/colet/pyth_blockchain/src")
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
 import miner
 import blockchain_structs as bs
+import nipopow
 from hashlib import sha1
 
 """
@@ -15,14 +17,14 @@ both UTXO objects and Transaction objects
 This includes finding block solutions and verifying/routing blocks and txs. 
 Signatures use the NIST192p curve by default (no reason to change the curve).
 
-### Change the sys.path to wherever the src directoy is stored on your system ###
-
 Run: python -m unittest tests/test_tx.py
 
 I think the best way to have the UTXO set is for it to be a dict with key: pub_key value: List[dicts representing a UTXO]
 or I could implement an equality
 """
 
+TX_HASH = sha1(b"previous tx").hexdigest()
+
 class TestUTXO(unittest.TestCase):
     chain = bs.Blockchain(25, 0x0FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF)
     # address of each wallet to send crypto to
@@ -34,7 +36,7 @@ class TestUTXO(unittest.TestCase):
         sk = SigningKey.generate() # private key
         vk = sk.verifying_key # public key
         pub_add = vk.to_string().hex()
-        message = bs.UTXO(25, pub_add, 0, 0).to_json().encode()
+        message = bs.UTXO(25, pub_add, TX_HASH, 0).signing_message()
         signature = sk.sign(message)
         self.assertEqual(True, vk.verify(signature, message))
 
@@ -43,16 +45,17 @@ class TestUTXO(unittest.TestCase):
         priv_key = SigningKey.generate() # private key
         pub_key= priv_key.verifying_key # public key
         pub_str = pub_key.to_string().hex() # now in a format we can input into a UTXO object and serialize it
-        a_UTXO = bs.UTXO(25, pub_str, 0, 0)
+        a_UTXO = bs.UTXO(25, pub_str, TX_HASH, 0)
         # assuring that we have successfully decoded the key from the UTXO
         self.assertEqual(VerifyingKey.from_string(bytearray.fromhex(a_UTXO.pub_key), curve=NIST192p), pub_key)
         
-        message = a_UTXO.to_json().encode()
+        message = a_UTXO.signing_message()
         signature = priv_key.sign(message)
         print(bytes.hex(signature))
         a_UTXO.set_sig(bytes.hex(signature)) # This is the type of UTXO we would see in a transaction (one with a signature)
         # Now we need to verify that this UTXO can be spent (has a valid signature from the public key attributed to it)
-        prove_message = a_UTXO.get_message().to_json().encode()
+        prove_message = a_UTXO.get_message().signing_message()
+        self.assertEqual(prove_message, a_UTXO.signing_message())
         verif_key = VerifyingKey.from_string(bytearray.fromhex(a_UTXO.pub_key), curve=NIST192p)
         decoded_sig = bytes.fromhex(a_UTXO.sig)
         self.assertTrue(verif_key.verify(decoded_sig, prove_message))
@@ -63,14 +66,90 @@ class TestUTXO(unittest.TestCase):
         priv_key = SigningKey.generate() # private key
         pub_key= priv_key.verifying_key # public key
         pub_str = pub_key.to_string().hex()
-        a_UTXO = bs.UTXO(25, pub_str, 0, 0)
-        utxo_set.append(a_UTXO.__dict__) # THIS IS THE UTXO WE WOULD HAVE IN THE SET BEFORE SEEING A TX
+        a_UTXO = bs.UTXO(25, pub_str, TX_HASH, 0)
+        utxo_set.append(a_UTXO.serialize()) # THIS IS THE UTXO WE WOULD HAVE IN THE SET BEFORE SEEING A TX
         signed_UTXO = copy.copy(a_UTXO)
-        message = a_UTXO.to_json().encode()
+        message = a_UTXO.signing_message()
         signature = priv_key.sign(message)
         print(bytes.hex(signature))
         signed_UTXO.set_sig(bytes.hex(signature)) # THIS IS THE SIGNED UTXO WE NEED TO VERIFY IS IN THE UTXO SET (HAS A SIGNATURE THO)
         check_UTXO = signed_UTXO.get_message()
-        print(f"CHECK_UTXO:{check_UTXO.__dict__} SET_UTXO:{a_UTXO.__dict__}") 
-        self.assertTrue(check_UTXO.__dict__ in utxo_set) # I think problem here is that my test is editing the UTXO in the set
+        print(f"CHECK_UTXO:{check_UTXO.to_json()} SET_UTXO:{a_UTXO.to_json()}") 
+        self.assertTrue(check_UTXO.serialize() in utxo_set)
+
+    def test_signing_message_excludes_signature(self):
+        utxo = bs.UTXO(25, miner.ADDRESSES[0][1], TX_HASH, 1)
+        unsigned = utxo.signing_message()
+        utxo.sign_utxo(miner.ADDRESSES[0][0])
+        self.assertEqual(utxo.signing_message(), unsigned)
+        self.assertNotEqual(utxo.serialize(), unsigned)
+        # signing again signs the same message, not one holding the previous signature
+        verif_key = VerifyingKey.from_string(bytearray.fromhex(utxo.pub_key), curve=NIST192p)
+        utxo.sign_utxo(miner.ADDRESSES[0][0])
+        self.assertTrue(verif_key.verify(bytes.fromhex(utxo.sig), unsigned))
+
+
+class TestKeyCache(unittest.TestCase):
+    def test_keys_are_parsed_once(self):
+        priv_key, pub_key = miner.ADDRESSES[2]
+        self.assertIs(bs.signing_key(priv_key), bs.signing_key(priv_key))
+        self.assertIs(bs.verifying_key(pub_key), bs.verifying_key(pub_key))
+        self.assertEqual(bs.signing_key(priv_key).to_string().hex(), priv_key)
+        self.assertEqual(bs.verifying_key(pub_key).to_string().hex(), pub_key)
+
+    def test_cached_keys_sign_and_verify(self):
+        priv_key, pub_key = miner.ADDRESSES[2]
+        utxo = bs.UTXO(25, pub_key, TX_HASH, 0)
+        utxo.sign_utxo(priv_key)
+        sig = bytes.fromhex(utxo.sig)
+        # the precomputed key and one parsed without the cache agree
+        self.assertTrue(bs.verifying_key(pub_key).verify(sig, utxo.signing_message()))
+        self.assertTrue(VerifyingKey.from_string(bytes.fromhex(pub_key), curve=NIST192p).verify(sig, utxo.signing_message()))
+        with self.assertRaises(BadSignatureError):
+            bs.verifying_key(pub_key).verify(sig, utxo.signing_message() + b"x")
+
+
+class TestTransaction(unittest.TestCase):
+    def make_tx(self, value = 10):
+        utxo = bs.UTXO(25, miner.ADDRESSES[0][1], TX_HASH, 0)
+        utxo.sign_utxo(miner.ADDRESSES[0][0])
+        tx = bs.Transaction([utxo], [bs.UTXO(value, miner.ADDRESSES[1][1]), bs.UTXO(25 - value, miner.ADDRESSES[0][1])])
+        return tx.set_tx_id()
+
+    def test_tx_id_is_hash_of_encoding(self):
+        tx = self.make_tx()
+        self.assertEqual(tx.tx_id, sha1(tx.serialize()).hexdigest())
+        self.assertEqual(miner.get_tx_hash(tx), tx.tx_id)
+        # the id doesn't depend on it being set already
+        self.assertEqual(tx.set_tx_id().tx_id, miner.get_tx_hash(tx))
+
+    def test_encoding_covers_every_field(self):
+        tx = self.make_tx()
+        other = self.make_tx(11)
+        other.timestamp = tx.timestamp
+        self.assertNotEqual(other.set_tx_id().tx_id, tx.tx_id)
+        other = self.make_tx()
+        other.timestamp = tx.timestamp
+        other.vin[0].id = (TX_HASH, 1)
+        self.assertNotEqual(other.set_tx_id().tx_id, tx.tx_id)
+        other.vin[0].id = None
+        self.assertNotEqual(other.set_tx_id().tx_id, tx.tx_id)
+
 
+    def test_tx_ids_survive_the_chain(self):
+        # outputs get their id when the block is added and a signature when they are spent,
+        # neither may change the id of the tx they belong to
+        difficulty = 0x7FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF
+        chain = miner.generate_blockchain(5, 25, difficulty)
+        txs = [tx for block in chain.chain for tx in block.txs]
+        self.assertTrue(any(utxo.id is not None for tx in txs for utxo in tx.vout))
+        for tx in txs:
+            self.assertEqual(tx.get_hash(), tx.tx_id)
+        # spend the outputs of the last block too
+        block = bs.Block(chain.head, [miner.create_coinbase_tx(miner.MINER[1], 25)] + miner.create_txs(chain.utxos, 10), chain.height + 1)
+        block.interlink = nipopow.Interlink(chain.chain[0])
+        block.interlink.update_interlink(chain.head, difficulty)
+        chain.add_block(miner.find_pow(block, difficulty))
+        self.assertTrue(any(utxo.sig for tx in chain.chain[-2].txs for utxo in tx.vout))
+        for tx in txs + block.txs:
+            self.assertEqual(tx.get_hash(), tx.tx_id)